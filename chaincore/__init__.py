@@ -0,0 +1,12 @@
+"""Chain engine shared by the network simulator (project1), the chat node
+(project2) and the voting app (project3).
+
+Binary header hashing and proof of work, Merkle roots, chain indexes,
+validation and an append-only block store. A project plugs its own block type
+in through an Adapter, so a speedup here reaches all three.
+"""
+from chaincore.adapter import Adapter
+from chaincore.chain import Chain, ChainIndex, validate_link
+from chaincore.hashing import encode_header, header_hash, item_id, meets_target, merkle_root, mine
+from chaincore.store import ChainStore
+
@@ -0,0 +1,45 @@
+from chaincore.hashing import header_hash, item_id
+
+
+class Adapter:
+    """How the core reads a project's block type.
+
+    The defaults read attributes (index, hash, prev_hash, nonce); a project
+    overrides what differs, e.g. dict blocks, and says which header fields are
+    hashed and which payload items (txs, votes) a block carries.
+    """
+
+    def height(self, block) -> int:
+        return block.index
+
+    def hash(self, block) -> str:
+        return block.hash
+
+    def prev_hash(self, block) -> str:
+        return block.prev_hash
+
+    def nonce(self, block) -> int:
+        return block.nonce
+
+    def header(self, block) -> tuple:
+        """Header fields in hashing order, without the nonce."""
+        raise NotImplementedError
+
+    def items(self, block):
+        return ()
+
+    def item_id(self, item) -> str:
+        return item_id(item)
+
+    def item_ids(self, block):
+        return [self.item_id(i) for i in self.items(block)]
+
+    def compute_hash(self, block) -> str:
+        return header_hash(*self.header(block), self.nonce(block))
+
+    # only needed with a ChainStore
+    def to_record(self, block) -> bytes:
+        raise NotImplementedError
+
+    def from_record(self, data: bytes):
+        raise NotImplementedError
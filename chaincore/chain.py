@@ -0,0 +1,125 @@
+from typing import Dict, List, Optional, Tuple
+
+from chaincore.adapter import Adapter
+from chaincore.hashing import meets_target
+
+
+class ChainIndex:
+    """Block hash -> height and payload item id -> (height, position) for the
+    active chain, so lookups never scan blocks."""
+
+    def __init__(self):
+        self.heights: Dict[str, int] = {}
+        self.items: Dict[str, Tuple[int, int]] = {}
+
+    def add(self, height, block_hash, item_ids):
+        self.heights[block_hash] = height
+        for i, iid in enumerate(item_ids):
+            self.items[iid] = (height, i)
+
+    def drop(self, height, block_hash, item_ids):
+        # only entries that still point at this block: an id may recur higher up
+        self.heights.pop(block_hash, None)
+        for i, iid in enumerate(item_ids):
+            if self.items.get(iid) == (height, i):
+                del self.items[iid]
+
+    def __contains__(self, block_hash):
+        return block_hash in self.heights
+
+
+def validate_link(adapter: Adapter, block, prev, zeros=0) -> Optional[str]:
+    """None if block extends prev correctly, otherwise the reason it does not."""
+    if adapter.height(block) != adapter.height(prev) + 1:
+        return "bad index"
+    if adapter.prev_hash(block) != adapter.hash(prev):
+        return "bad prev_hash"
+    if adapter.compute_hash(block) != adapter.hash(block):
+        return "bad hash"
+    if not meets_target(adapter.hash(block), zeros):
+        return "insufficient proof of work"
+    return None
+
+
+class Chain:
+    """A linear chain of blocks: every append is validated and indexed, and
+    written to a ChainStore if one is given. A stored chain is revalidated
+    block by block when it is loaded.
+
+    Fork choice is left to the project: the chat node keeps its own and only
+    uses the index and validation pieces.
+    """
+
+    def __init__(self, adapter: Adapter, zeros=0, store=None):
+        self.adapter = adapter
+        self.zeros = zeros
+        self.store = store
+        self.blocks: List = []
+        self.index = ChainIndex()
+        if store is not None:
+            for record in store.records():
+                block = adapter.from_record(record)
+                reason = self.check(block)
+                if reason:
+                    raise ValueError(f"stored block {len(self.blocks)}: {reason}")
+                self._add(block)
+
+    def check(self, block) -> Optional[str]:
+        if not self.blocks:
+            # genesis: nothing to link to, but its hash must still be its own
+            if self.adapter.compute_hash(block) != self.adapter.hash(block):
+                return "bad hash"
+            return None
+        return validate_link(self.adapter, block, self.blocks[-1], self.zeros)
+
+    def append(self, block) -> Optional[str]:
+        """Add block on top of the tip. Returns None, or why it was refused."""
+        reason = self.check(block)
+        if reason:
+            return reason
+        self._add(block)
+        if self.store is not None:
+            self.store.append(self.adapter.to_record(block))
+        return None
+
+    def _add(self, block):
+        self.index.add(len(self.blocks), self.adapter.hash(block), self.adapter.item_ids(block))
+        self.blocks.append(block)
+
+    def truncate(self, height) -> List:
+        """Drop every block above `height`; returns them, lowest first."""
+        dropped = self.blocks[height + 1:]
+        for h in range(len(self.blocks) - 1, height, -1):
+            b = self.blocks[h]
+            self.index.drop(h, self.adapter.hash(b), self.adapter.item_ids(b))
+        del self.blocks[height + 1:]
+        if self.store is not None:
+            self.store.truncate(len(self.blocks))
+        return dropped
+
+    @property
+    def tip(self):
+        return self.blocks[-1]
+
+    def block_by_hash(self, block_hash):
+        height = self.index.heights.get(block_hash)
+        return None if height is None else self.blocks[height]
+
+    def locate(self, item_id):
+        """(block, position) of a payload item on the chain, or None."""
+        loc = self.index.items.get(item_id)
+        return None if loc is None else (self.blocks[loc[0]], loc[1])
+
+    def is_valid(self) -> bool:
+        # full recheck, e.g. after blocks were edited in memory
+        return all(validate_link(self.adapter, b, p, self.zeros) is None
+                   for p, b in zip(self.blocks, self.blocks[1:]))
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def __getitem__(self, i):
+        return self.blocks[i]
@@ -0,0 +1,79 @@
+import hashlib, json, struct
+
+_LEAF, _NODE = b"\x00", b"\x01"   # merkle domain separation
+
+
+def _field(value) -> bytes:
+    # type-tagged and length-prefixed, so two different headers never encode alike
+    if isinstance(value, bool):
+        raise TypeError("bool header fields are ambiguous; use an int")
+    if isinstance(value, int):
+        return b"i" + value.to_bytes(8, "big", signed=True)
+    if isinstance(value, float):
+        return b"f" + struct.pack(">d", value)
+    if isinstance(value, str):
+        value = value.encode()
+        return b"s" + struct.pack(">I", len(value)) + value
+    if isinstance(value, (bytes, bytearray)):
+        return b"b" + struct.pack(">I", len(value)) + bytes(value)
+    raise TypeError(f"unsupported header field type {type(value).__name__}")
+
+
+def encode_header(*fields) -> bytes:
+    """Binary header: one tagged field after another. The nonce goes last, so
+    everything before it can be hashed once per block rather than once per try."""
+    return b"".join(_field(f) for f in fields)
+
+
+def header_hash(*fields) -> str:
+    return hashlib.sha256(encode_header(*fields)).hexdigest()
+
+
+def item_id(item) -> str:
+    # sha256 of canonical JSON: the same tx or vote gets the same id everywhere
+    return hashlib.sha256(json.dumps(item, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def merkle_root(ids) -> str:
+    """Pairwise sha256 up to a single root. Leaves and interior nodes are hashed
+    with different prefixes, and an odd node is carried up a level rather than
+    paired with itself, so no other list of ids (interior hashes passed off as
+    ids, a repeated last id) has the same root. Repeated ids are refused."""
+    if len(set(ids)) != len(ids):
+        raise ValueError("repeated id in merkle tree")
+    level = [hashlib.sha256(_LEAF + bytes.fromhex(i)).digest() for i in ids]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+    while len(level) > 1:
+        paired = [hashlib.sha256(_NODE + level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].hex()
+
+
+def meets_target(block_hash: str, zeros: int) -> bool:
+    return block_hash.startswith("0" * zeros)
+
+
+def mine(fields, zeros: int, start=0):
+    """Smallest nonce >= start for which header_hash(*fields, nonce) has `zeros`
+    leading hex zeros. Returns (nonce, hash).
+
+    The fixed fields are hashed once and the sha256 state copied per try, and
+    the digest is compared as bytes against the target, so a try costs one
+    compression of the nonce bytes and no encoding.
+    """
+    base = hashlib.sha256(encode_header(*fields))
+    nonce = start
+    if zeros <= 0:
+        return nonce, header_hash(*fields, nonce)
+    # digests below 16**(64 - zeros) are exactly those with `zeros` leading hex zeros
+    target = (16 ** (64 - zeros)).to_bytes(32, "big")
+    while True:
+        h = base.copy()
+        h.update(b"i" + nonce.to_bytes(8, "big", signed=True))
+        digest = h.digest()
+        if digest < target:
+            return nonce, digest.hex()
+        nonce += 1
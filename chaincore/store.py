@@ -0,0 +1,66 @@
+import os, struct, threading, zlib
+
+_HEAD = struct.Struct(">II")   # record length, crc32 of the record
+
+
+class ChainStore:
+    """Append-only file of block records, each prefixed with its length and CRC32.
+
+    Records are read back in order on open. A torn tail (a crash in the middle
+    of a write) is cut off, so the chain reloads up to the last block that was
+    fully written; a complete record failing its CRC is corruption and raises.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._offsets = []    # file offset of each record
+        self._records = []
+        self._f = open(path, "a+b")
+        self._scan()
+
+    def _scan(self):
+        self._f.seek(0)
+        data = self._f.read()
+        pos = 0
+        while pos + _HEAD.size <= len(data):
+            length, crc = _HEAD.unpack_from(data, pos)
+            record = data[pos + _HEAD.size:pos + _HEAD.size + length]
+            if len(record) < length:
+                break
+            if zlib.crc32(record) != crc:
+                raise ValueError(f"{self.path}: record {len(self._records)} is corrupt")
+            self._offsets.append(pos)
+            self._records.append(record)
+            pos += _HEAD.size + length
+        if pos < len(data):
+            self._f.truncate(pos)
+
+    def records(self):
+        """The records found on open, oldest first; handed over once, not kept."""
+        records, self._records = self._records, []
+        return records
+
+    def append(self, record: bytes):
+        with self._lock:
+            self._f.seek(0, os.SEEK_END)
+            self._offsets.append(self._f.tell())
+            self._f.write(_HEAD.pack(len(record), zlib.crc32(record)) + record)
+            self._f.flush()
+            if self.fsync:
+                os.fsync(self._f.fileno())
+
+    def truncate(self, count):
+        # keep the first `count` records (a reorg drops the rest)
+        with self._lock:
+            if count < len(self._offsets):
+                self._f.truncate(self._offsets[count])
+                del self._offsets[count:]
+                self._f.flush()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def close(self):
+        self._f.close()
@@ -1,8 +1,8 @@
 # blockchain_pyqt.py (updated with trails + flash)
+import os
 import sys
 import random
 import time
-import hashlib
 from dataclasses import dataclass, field
 from typing import List, Dict, Tuple
 
@@ -15,10 +15,10 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import matplotlib.pyplot as plt
 import networkx as nx
 
-# ---------------- Utilities / Blockchain primitives ----------------
-def sha256(s: str) -> str:
-    return hashlib.sha256(s.encode()).hexdigest()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # shared chaincore package
+from chaincore import Adapter, Chain, header_hash, mine
 
+# ---------------- Utilities / Blockchain primitives ----------------
 @dataclass
 class Block:
     index: int
@@ -27,17 +27,34 @@ class Block:
     nonce: int = 0
     timestamp: float = field(default_factory=time.time)
 
+    def header(self) -> tuple:
+        return (self.index, self.prev_hash, self.data, float(self.timestamp))
+
     def compute_hash(self) -> str:
-        return sha256(f"{self.index}{self.prev_hash}{self.data}{self.nonce}{self.timestamp}")
+        return header_hash(*self.header(), self.nonce)
 
     @property
     def hash(self) -> str:
         return self.compute_hash()
 
+class BlockAdapter(Adapter):
+    def header(self, block: Block) -> tuple:
+        return block.header()
+
+ADAPTER = BlockAdapter()
+
 class Blockchain:
     def __init__(self, difficulty_prefix: str = "00"):
-        self.chain: List[Block] = [self._create_genesis()]
+        if difficulty_prefix.strip("0"):
+            raise ValueError("difficulty_prefix must be leading zeros, e.g. '00'")
         self.difficulty_prefix = difficulty_prefix
+        # validation and hashing live in the shared core
+        self.core = Chain(ADAPTER, zeros=len(difficulty_prefix))
+        self.core.append(self._create_genesis())
+
+    @property
+    def chain(self) -> List[Block]:
+        return self.core.blocks
 
     def _create_genesis(self) -> Block:
         return Block(0, "0", "genesis", nonce=0, timestamp=time.time())
@@ -46,22 +63,15 @@ class Blockchain:
         return self.chain[-1]
 
     def add_block(self, block: Block) -> bool:
-        if block.prev_hash != self.last_block().hash:
-            return False
-        if not block.hash.startswith(self.difficulty_prefix):
-            return False
-        self.chain.append(block)
-        return True
+        return self.core.append(block) is None
 
     def mine_block(self, miner_id: str, data: str = "") -> Block:
         index = self.last_block().index + 1
         prev_hash = self.last_block().hash
-        nonce = 0
-        while True:
-            blk = Block(index=index, prev_hash=prev_hash, data=f"{data}|by:{miner_id}", nonce=nonce)
-            if blk.hash.startswith(self.difficulty_prefix):
-                return blk
-            nonce += 1
+        data = f"{data}|by:{miner_id}"
+        timestamp = time.time()
+        nonce, _ = mine((index, prev_hash, data, timestamp), len(self.difficulty_prefix))
+        return Block(index=index, prev_hash=prev_hash, data=data, nonce=nonce, timestamp=timestamp)
 
 # ---------------- Network / Node simulation ----------------
 @dataclass
@@ -0,0 +1,92 @@
+import math, threading, time
+from collections import OrderedDict
+
+MAX_BUCKETS = 10000   # clients/peers tracked at once; the idlest are forgotten
+
+
+class Throttled(Exception):
+    """Request refused for now; the client may retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after=1.0):
+        super().__init__(reason)
+        self.reason, self.retry_after = reason, retry_after
+
+
+class TooLarge(Exception):
+    """Request costs more than the caller's whole burst, so no wait would let it through."""
+
+    def __init__(self, cost, burst):
+        super().__init__(f"costs {cost:g}, more than the burst of {burst:g}")
+        self.cost, self.burst = cost, burst
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def take(self, n=1) -> float:
+        # 0 if the tokens were taken, else seconds until there will be enough;
+        # more than the bucket can ever hold is refused for good (inf)
+        if n > self.burst:
+            return math.inf
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """One token bucket per key (client address, peer url)."""
+
+    def __init__(self, rate, burst, max_keys=MAX_BUCKETS):
+        self.rate, self.burst = rate, burst
+        self._buckets = OrderedDict()
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def take(self, key, n=1) -> float:
+        if not self.rate:
+            return 0.0   # limiting off
+        if n > self.burst:
+            raise TooLarge(n, self.burst)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self._max_keys:
+                    # a forgotten key starts over with a full bucket, which only errs on the lenient side
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(n)
+
+
+class Gate:
+    """At most `limit` units of work in progress; entering never waits, so a full
+    gate turns into an immediate 429 instead of a growing queue."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def enter(self) -> bool:
+        with self._lock:
+            if self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+    def full(self):
+        return self.active >= self.limit
@@ -0,0 +1,230 @@
+"""Microbenchmarks for the wallet crypto and block hashing primitives.
+
+    python bench.py                                  # run everything, print ops/sec
+    python bench.py --save bench_baseline.json       # record a baseline
+    python bench.py --compare bench_baseline.json    # flag cases more than 10% slower
+
+Inputs are fixed (seeded messages, a fixed block), every case is warmed up
+before it is timed, and timing takes the best of several rounds, which is the
+least noisy estimate on a busy machine. Allocations are measured in a separate
+pass under tracemalloc: Python-level bytes only, so memory OpenSSL allocates
+inside the cryptography bindings does not show up. Runs offline; compares
+only make sense between runs on the same machine.
+"""
+import argparse, json, platform, random, sys, time, tracemalloc
+
+import wallet
+from blockchain import Block, Blockchain, MINING_DIFFICULTY
+from wallet import (
+    SCHEME_ED25519,
+    SCHEME_RSA,
+    decrypt_with_private,
+    encrypt_for_group,
+    encrypt_with_public,
+    generate_rsa_keypair,
+    generate_signing_keypair,
+    sign_message,
+    verify_signature,
+)
+
+SEED = 1234
+MESSAGE_SIZES = (64, 1024, 16384)       # bytes
+BLOCK_SIZES = (1, 100, 1000)            # transactions
+GROUP_SIZE = 50
+ROUNDS = 5
+MIN_ROUND_SECONDS = 0.2
+WARMUP_SECONDS = 0.1
+ALLOC_OPS = 20
+
+
+# ---- fixed inputs ----
+def message(size):
+    # printable, and about as compressible as chat text
+    rnd = random.Random(SEED + size)
+    words = ["block", "chain", "node", "peer", "hello", "message", "key", "tx", "relay", "mine"]
+    text = ""
+    while len(text) < size:
+        text += rnd.choice(words) + " "
+    return text[:size]
+
+
+def transactions(n):
+    rnd = random.Random(SEED + n)
+    return [{"from": f"http://127.0.0.1:{5000 + rnd.randrange(100)}",
+             "to": f"http://127.0.0.1:{5000 + rnd.randrange(100)}",
+             "message": "%064x" % rnd.getrandbits(256),
+             "signature": "%0128x" % rnd.getrandbits(512)} for _ in range(n)]
+
+
+def fixed_block(n_txs):
+    return Block(1, 1700000000.0, transactions(n_txs), "0" * 64, 0)
+
+
+# ---- cases ----
+def cases():
+    """(name, fn) pairs; each fn runs one operation. Setup happens here, untimed."""
+    out = []
+    rsa_priv, rsa_pub = generate_rsa_keypair()
+    ed_priv, ed_pub = generate_signing_keypair(SCHEME_ED25519)
+
+    out.append(("keygen/rsa-2048", generate_rsa_keypair))
+    out.append(("keygen/ed25519", lambda: generate_signing_keypair(SCHEME_ED25519)))
+
+    for size in MESSAGE_SIZES:
+        data = message(size).encode()
+        for scheme, priv, pub in ((SCHEME_RSA, rsa_priv, rsa_pub), (SCHEME_ED25519, ed_priv, ed_pub)):
+            sig = sign_message(priv, data)
+            out.append((f"sign/{scheme}/{size}B", lambda p=priv, d=data: sign_message(p, d)))
+            out.append((f"verify/{scheme}/{size}B",
+                        lambda p=pub, d=data, s=sig, sc=scheme: verify_signature(p, d, s, sc)))
+
+    for size in MESSAGE_SIZES:
+        text = message(size)
+        ct = encrypt_with_public(rsa_pub, text)
+        # warm: the per-recipient session key (sender) and unwrap (recipient) are cached;
+        # cold: every message pays the RSA wrap or unwrap, as the first one to a peer does
+        out.append((f"encrypt/warm/{size}B", lambda t=text: encrypt_with_public(rsa_pub, t)))
+        out.append((f"encrypt/cold/{size}B", lambda t=text: cold(encrypt_with_public, rsa_pub, t)))
+        out.append((f"decrypt/warm/{size}B", lambda c=ct: decrypt_with_private(rsa_priv, c)))
+        out.append((f"decrypt/cold/{size}B", lambda c=ct: cold(decrypt_with_private, rsa_priv, c)))
+
+    members = [rsa_pub] + [generate_rsa_keypair()[1] for _ in range(GROUP_SIZE - 1)]
+    text = message(1024)
+    group_ct = encrypt_for_group(members, text)
+    out.append((f"encrypt/group{GROUP_SIZE}/cold/1024B", lambda: cold(encrypt_for_group, members, text)))
+    out.append((f"decrypt/group{GROUP_SIZE}/cold/1024B", lambda: cold(decrypt_with_private, rsa_priv, group_ct)))
+
+    for n in BLOCK_SIZES:
+        txs = transactions(n)
+        block = fixed_block(n)
+        out.append((f"block/build/{n}tx", lambda t=txs: Block(1, 1700000000.0, t, "0" * 64, 0)))
+        out.append((f"block/compute_hash/{n}tx", block.compute_hash))
+
+    chain = Blockchain()
+    pow_block = fixed_block(100)
+
+    def pow_once():
+        pow_block.nonce = 0   # same block, same nonce search every time
+        return chain.proof_of_work(pow_block)
+    out.append((f"block/proof_of_work/difficulty{MINING_DIFFICULTY}", pow_once))
+    return out
+
+
+def cold(fn, *args):
+    wallet._send_sessions.clear()
+    wallet._group_sessions.clear()
+    wallet._unwrapped.clear()
+    return fn(*args)
+
+
+# ---- measurement ----
+def time_case(fn, rounds=ROUNDS, min_round=MIN_ROUND_SECONDS, warmup=WARMUP_SECONDS):
+    """Best ops/sec over `rounds` rounds of at least `min_round` seconds each."""
+    deadline = time.perf_counter() + warmup
+    n = 0
+    while time.perf_counter() < deadline or n == 0:
+        fn()
+        n += 1
+    # size rounds from the warmup rate so timer overhead stays negligible
+    per_round = max(1, int(n / warmup * min_round))
+    best = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(per_round):
+            fn()
+        elapsed = time.perf_counter() - start
+        best = max(best, per_round / elapsed)
+    return best
+
+
+def alloc_case(fn, ops=ALLOC_OPS):
+    """(bytes allocated per op, peak bytes during one op), Python allocations only."""
+    fn()   # caches, lazy imports
+    tracemalloc.start()
+    try:
+        allocated, peak = 0, 0
+        for _ in range(ops):
+            snap = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+            after = tracemalloc.take_snapshot()
+            allocated += sum(s.size_diff for s in after.compare_to(snap, "filename") if s.size_diff > 0)
+            del result
+        return allocated // ops, peak
+    finally:
+        tracemalloc.stop()
+
+
+def run(pattern=None, rounds=ROUNDS, min_round=MIN_ROUND_SECONDS, allocations=True):
+    results = {}
+    for name, fn in cases():
+        if pattern and pattern not in name:
+            continue
+        ops = time_case(fn, rounds, min_round)
+        r = {"ops_per_sec": round(ops, 2), "us_per_op": round(1e6 / ops, 2)}
+        if allocations:
+            r["alloc_bytes_per_op"], r["peak_bytes"] = alloc_case(fn)
+        results[name] = r
+        print(format_row(name, r), flush=True)
+    return results
+
+
+# ---- report ----
+def format_row(name, r, delta=None):
+    row = f"{name:<40} {r['ops_per_sec']:>12,.1f} ops/s {r['us_per_op']:>12,.1f} us/op"
+    if "alloc_bytes_per_op" in r:
+        row += f" {r['alloc_bytes_per_op']:>10,} B/op {r['peak_bytes']:>10,} B peak"
+    if delta is not None:
+        row += f" {delta:>+8.1%}"
+    return row
+
+
+def compare(results, baseline, threshold):
+    """Names of cases whose ops/sec fell by more than `threshold` against the baseline."""
+    regressions = []
+    print(f"\nagainst baseline ({baseline['meta'].get('python')}, {baseline['meta'].get('when')}):")
+    for name, r in results.items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:<40} new")
+            continue
+        delta = r["ops_per_sec"] / old["ops_per_sec"] - 1
+        flag = " REGRESSION" if delta < -threshold else ""
+        print(format_row(name, r, delta) + flag)
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def meta():
+    return {"python": platform.python_version(), "machine": platform.machine(),
+            "platform": platform.platform(), "when": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("-k", "--filter", help="only cases whose name contains this")
+    ap.add_argument("--rounds", type=int, default=ROUNDS)
+    ap.add_argument("--min-round", type=float, default=MIN_ROUND_SECONDS, help="seconds per timing round")
+    ap.add_argument("--no-alloc", action="store_true", help="skip the tracemalloc pass")
+    ap.add_argument("--save", help="write the results here as a baseline")
+    ap.add_argument("--compare", help="baseline file to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="slowdown that counts as a regression")
+    args = ap.parse_args()
+
+    results = run(args.filter, args.rounds, args.min_round, not args.no_alloc)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta(), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,97 +1,343 @@
-import json,time,hashlib
+import json,logging,os,sys,time
 from typing import List,Dict
 
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),"..",".."))  # shared chaincore package
+from chaincore import Adapter,ChainIndex,header_hash,item_id,merkle_root,mine,validate_link
+
 MINING_DIFFICULTY=3
+GENESIS_TIMESTAMP=0  # fixed so every node derives the same genesis hash
+MAX_ORPHANS=256
+PRUNED_SYNC_DEPTH=100  # bodies-less blocks from peers are only accepted this deep
+
+log=logging.getLogger(__name__)
+
+tx_id=item_id  # sha256 of the tx's canonical JSON
+
+def block_work(block)->int:
+    # expected number of hashes needed to meet the difficulty target
+    return 16**MINING_DIFFICULTY
 
 class Block:
-    def __init__(self,index,timestamp,transactions:List[Dict],prev_hash,nonce=0):
+    def __init__(self,index,timestamp,transactions:List[Dict],prev_hash,nonce=0,tx_ids:List[str]=None):
         self.index=index
         self.timestamp=timestamp
-        self.transactions=transactions
+        self.transactions=transactions   # None once the block is pruned
         self.prev_hash=prev_hash
         self.nonce=nonce
+        self.tx_ids=[tx_id(t) for t in transactions] if transactions is not None else list(tx_ids)
+        self.merkle_root=merkle_root(self.tx_ids)
         self.hash=self.compute_hash()
+        self.total_work=0  # cumulative work up to and including this block
+
+    @property
+    def pruned(self):
+        return self.transactions is None
     
+    def header_fields(self):
+        # the hash covers the header only; txs are committed to through the merkle
+        # root, so a block stays verifiable after its bodies are dropped
+        return (int(self.index),float(self.timestamp),self.merkle_root,self.prev_hash)
+
     def compute_hash(self):
-        block_string=json.dumps({
+        return header_hash(*self.header_fields(),self.nonce)
+    
+    def to_dict(self):
+        d={
             'index':self.index,
             'timestamp':self.timestamp,
-            'transaction':self.transactions,
+            'merkle_root':self.merkle_root,
             'prev_hash':self.prev_hash,
-            'nonce':self.nonce
-        },sort_keys=True)
-        return hashlib.sha256(block_string.encode()).hexdigest()
-    
-    def to_dict(self):
+            'nonce':self.nonce,
+            'hash':self.hash
+        }
+        if self.pruned:
+            d['pruned']=True
+            d['tx_ids']=self.tx_ids
+        else:
+            d['transactions']=self.transactions
+        return d
+
+    def header(self):
         return{
             'index':self.index,
             'timestamp':self.timestamp,
-            'transaction':self.transactions,
+            'merkle_root':self.merkle_root,
             'prev_hash':self.prev_hash,
             'nonce':self.nonce,
-            'hash':self.hash
+            'hash':self.hash,
+            'tx_count':len(self.tx_ids)
         }
-    
+
+    def prune(self):
+        # keep the header and tx ids, drop the bodies and the bytes cached for them
+        self.transactions=None
+        self.__dict__.pop('packed',None)
+        self.freeze()
+
+    def freeze(self):
+        # serialize once; the chain endpoints reuse these bytes on every request
+        self.serialized=json.dumps(self.to_dict(),sort_keys=True,separators=(',',':')).encode()
+        self.header_serialized=json.dumps(self.header(),sort_keys=True,separators=(',',':')).encode()
+
+class BlockAdapter(Adapter):
+    # how chaincore reads our blocks; tx ids are kept even once bodies are pruned
+    def header(self,block):
+        return block.header_fields()
+
+    def items(self,block):
+        return block.transactions or ()
+
+    def item_ids(self,block):
+        return block.tx_ids
+
+ADAPTER=BlockAdapter()
+
+def block_from_dict(bdict)->Block:
+    # pruned blocks carry tx_ids instead of transactions
+    b=Block(bdict['index'],bdict['timestamp'],bdict.get('transactions'),bdict['prev_hash'],bdict['nonce'],
+            tx_ids=bdict.get('tx_ids'))
+    b.hash=bdict['hash']
+    return b
+
 class Blockchain:
-        def __init__(self):
+        def __init__(self,prune_depth:int=None):
+            self.prune_depth=prune_depth        # drop tx bodies this many blocks below the tip
             self.chain:List[Block]=[]
             self.pending_transactions:List[Dict]=[]
+            self.pending_ids=set()
+            self.index=ChainIndex()
+            self.hash_index:Dict[str,int]=self.index.heights   # block hash -> height on the active chain
+            self.tx_index:Dict[str,tuple]=self.index.items     # tx id -> (height, position) on the active chain
+            self.orphans:Dict[str,Block]={}     # blocks whose parent we have not seen yet
+            self.final_height=0                 # highest pruned block; no reorg goes below it
+            self.listeners=[]                   # callables(kind,data) for "tx", "block", "reorg" and "prune"
             self.create_genesis()
         
         def create_genesis(self):
-            genesis=Block(0,time.time(),[],"0",0)
+            genesis=Block(0,GENESIS_TIMESTAMP,[],"0",0)
             genesis.hash=genesis.compute_hash()
-            self.chain.append(genesis)
+            self.append_block(genesis)
         
         def last_block(self):
             return self.chain[-1]
+
+        def notify(self,kind,data):
+            # called in the middle of chain updates: a failing listener is logged,
+            # never allowed to leave the chain half switched
+            for listener in self.listeners:
+                try:
+                    listener(kind,data)
+                except Exception:
+                    log.exception("chain listener %r failed on %s",listener,kind)
+
+        def append_block(self,block:Block):
+            block.total_work=(self.chain[-1].total_work if self.chain else 0)+block_work(block)
+            block.freeze()
+            self.index.add(len(self.chain),block.hash,block.tx_ids)
+            self.chain.append(block)
+            if block.pruned:
+                self.final_height=block.index
+            self.notify("block",block)
+            if self.prune_depth:
+                self.prune_at(len(self.chain)-1-self.prune_depth)
+
+        def prune_at(self,height:int):
+            # listeners (archive, indexes) get the bodies once more before they go
+            if height<=0 or self.chain[height].pruned:
+                return
+            self.notify("prune",self.chain[height])
+            self.chain[height].prune()
+            self.final_height=max(self.final_height,height)
+
+        def blocks_range(self,start=0,limit=None)->List[Block]:
+            start=max(start,0)
+            end=len(self.chain) if limit is None else start+max(limit,0)
+            return self.chain[start:end]
         
-        def add_transaction(self,tx:Dict):
+        def add_transaction(self,tx:Dict)->bool:
+            # a tx goes in once: neither while pending nor once it is on the chain
+            tid=tx_id(tx)
+            if tid in self.pending_ids or tid in self.tx_index:
+                return False
+            self.pending_ids.add(tid)
             self.pending_transactions.append(tx)
+            self.notify("tx",tx)
+            return True
+
+        def add_transactions(self,txs:List[Dict])->List[bool]:
+            return [self.add_transaction(tx) for tx in txs]
 
         def proof_of_work(self,block: Block):
-            target='0'*MINING_DIFFICULTY
-            while not block.compute_hash().startswith(target):
-                block.nonce+=1
-            block.hash=block.compute_hash()
+            # only the nonce is hashed per try; the rest of the header once per block
+            block.nonce,block.hash=mine(block.header_fields(),MINING_DIFFICULTY,block.nonce)
             return block.hash
         
-        def mine(self):
+        def new_block(self):
+            # candidate on top of the current tip; proof of work is done separately
             if not self.pending_transactions:
                 return None
-            new_block=Block(self.last_block().index+1, time.time(),
-                            self.pending_transactions.copy(),self.last_block().hash,0)
+            return Block(self.last_block().index+1, time.time(),
+                         self.pending_transactions.copy(),self.last_block().hash,0)
+
+        def mine(self):
+            new_block=self.new_block()
+            if new_block is None:
+                return None
             self.proof_of_work(new_block)
-            self.chain.append(new_block)
-            self.pending_transactions=[]
+            if self.accept_block(new_block)!="added":
+                return None
             return new_block.to_dict()
+
+        # ---- block acceptance ----
+        def validate_block(self,block:Block,prev:Block):
+            """Return None if block extends prev correctly, otherwise the reason it does not."""
+            reason=validate_link(ADAPTER,block,prev,MINING_DIFFICULTY)
+            if reason:
+                return reason
+            if block.pruned:
+                if not isinstance(block.tx_ids,list):
+                    return "bad tx ids"
+            elif not isinstance(block.transactions,list):
+                return "bad transactions"
+            return None
+
+        def replayed_tx(self,block:Block,fork:int,seen:set):
+            """The reason block repeats a tx that is already confirmed at or below fork,
+            or earlier in the same branch (ids collected in seen), else None."""
+            for tid in block.tx_ids:
+                loc=self.tx_index.get(tid)
+                if tid in seen or (loc is not None and loc[0]<=fork):
+                    return "tx already confirmed"
+                seen.add(tid)
+            return None
+
+        def accept_block(self,block:Block)->str:
+            """Returns "added", "duplicate", "stale", "orphan" or "invalid: <reason>"."""
+            if block.hash in self.hash_index:
+                return "duplicate"
+            if block.hash in self.orphans:
+                return "orphan"   # announced again: its ancestors may only be partly fetched yet
+            if block.prev_hash not in self.hash_index:
+                if len(self.orphans)>=MAX_ORPHANS:
+                    self.orphans.pop(next(iter(self.orphans)))
+                self.orphans[block.hash]=block
+                return "orphan"
+            return self.add_branch([block])
+
+        def add_branch(self,branch:List[Block])->str:
+            """Attach a run of linked blocks whose first parent is on our chain; switch to it
+            if it carries more cumulative work than the current tip."""
+            while branch and branch[0].hash in self.hash_index:
+                branch=branch[1:]   # prefix we already have on the active chain
+            if not branch:
+                return "duplicate"
+            fork=self.hash_index.get(branch[0].prev_hash)
+            if fork is None:
+                return "orphan"
+            if fork<self.final_height or (self.prune_depth and fork<len(self.chain)-1-self.prune_depth):
+                return "stale"   # pruned history is final: a reorg could not requeue its txs
+            prev=self.chain[fork]
+            work=prev.total_work
+            tip=branch[-1].index
+            seen=set()
+            for b in branch:
+                # txs in blocks above the fork are being replaced, so they may recur
+                reason=self.validate_block(b,prev) or self.replayed_tx(b,fork,seen)
+                if not reason and b.pruned and tip-b.index<(self.prune_depth or PRUNED_SYNC_DEPTH):
+                    reason="pruned block too close to the tip"
+                if reason:
+                    return "invalid: "+reason
+                work+=block_work(b)
+                prev=b
+            if work<=self.last_block().total_work:
+                return "stale"
+            self.switch_to(fork,branch)
+            self.connect_orphans()
+            return "added"
+
+        def switch_to(self,fork:int,new_blocks:List[Block]):
+            # drop everything above the fork point, re-queue their txs, then extend
+            dropped=self.chain[fork+1:]
+            for b in dropped:
+                self.index.drop(b.index,b.hash,b.tx_ids)
+            del self.chain[fork+1:]
+            if dropped:
+                self.notify("reorg",dropped)
+            for b in new_blocks:
+                self.append_block(b)
+                self.orphans.pop(b.hash,None)
+            confirmed={tid for b in new_blocks for tid in b.tx_ids}
+            requeue=[t for b in dropped for t in b.transactions]
+            seen=set()
+            pending=[]
+            for t in requeue+self.pending_transactions:
+                tid=tx_id(t)
+                if tid in confirmed or tid in seen:
+                    continue
+                seen.add(tid)
+                pending.append(t)
+            self.pending_transactions=pending
+            self.pending_ids=seen
+
+        def load_snapshot(self,blocks:List[Block])->str:
+            """Adopt a chain restored from a snapshot. Headers are checked here (links,
+            hashes, merkle roots, proof of work, no repeated txs); tx signatures are not,
+            so the caller verifies the newest bodies first. The snapshot's checksum only
+            shows the chunks arrived intact from the peer that made it, not that it is
+            honest; pruned blocks, and bodies older than the caller checks, are covered
+            by their headers alone."""
+            if not blocks or blocks[0].hash!=self.chain[0].hash:
+                return "invalid: different genesis"
+            prev=self.chain[0]
+            work=prev.total_work
+            seen=set()
+            for b in blocks[1:]:
+                reason=self.validate_block(b,prev) or self.replayed_tx(b,0,seen)
+                if reason:
+                    return "invalid: "+reason
+                work+=block_work(b)
+                prev=b
+            if work<=self.last_block().total_work or self.final_height>0:
+                return "stale"
+            self.switch_to(0,blocks[1:])
+            self.connect_orphans()
+            return "added"
+
+        def connect_orphans(self):
+            progress=True
+            while progress:
+                progress=False
+                for h,b in list(self.orphans.items()):
+                    if b.prev_hash in self.hash_index:
+                        del self.orphans[h]
+                        self.add_branch([b])
+                        progress=True
+
+        def orphan_children(self,block_hash)->List[Block]:
+            # orphans stacked on top of block_hash, in height order
+            out=[]
+            tip=block_hash
+            while True:
+                nxt=next((b for b in self.orphans.values() if b.prev_hash==tip),None)
+                if nxt is None:
+                    return out
+                out.append(nxt)
+                tip=nxt.hash
         
         def is_valid_chain(self,chain_data:List[Dict])->bool:
-            prev=None
-            for idx,blk in enumerate(chain_data):
-                b_hash=blk['hash']
-
-                recomputed=hashlib.sha256(json.dumps({
-                    'index':blk['index'],
-                    'timestamp':blk['timestamp'],
-                    'transactions':blk['transactions'],
-                    'prev_hash':blk['prev_hash'],
-                    'nonce':blk['nonce']
-                },sort_keys=True).encode()).hexdigest()
-                if recomputed!=b_hash:
+            if not chain_data or chain_data[0]['hash']!=self.chain[0].hash:
+                return False
+            prev=block_from_dict(chain_data[0])
+            for blk in chain_data[1:]:
+                b=block_from_dict(blk)
+                if self.validate_block(b,prev):
                     return False
-                if idx>0:
-                    if blk['prev_hash']!=chain_data[idx-1]['hash']:
-                        return False
-                    if not b_hash.startswith('0'*MINING_DIFFICULTY):
-                        return False
+                prev=b
             return True
         
         def replace_chain(self,new_chain:List[Dict]):
-            if len(new_chain)>len(self.chain) and self.is_valid_chain(new_chain):
-                self.chain=[Block(b['index'],b['timestamp'], b['transactions'], b['prev_hash'], b['nonce']) for b in new_chain]
-                for i , b in enumerate(self.chain):
-                    b.hash=new_chain[i]['hash']
+            new_work=sum(block_work(b) for b in new_chain)
+            if new_work>self.last_block().total_work and not self.final_height and self.is_valid_chain(new_chain):
+                self.switch_to(0,[block_from_dict(b) for b in new_chain[1:]])
                 return True
             return False
-        
\ No newline at end of file
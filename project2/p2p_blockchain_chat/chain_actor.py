@@ -0,0 +1,104 @@
+import itertools, queue, threading
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from blockchain import Block, Blockchain
+
+PRIORITY_BLOCK = 0   # blocks, mining and reads: always queued, run first
+PRIORITY_TX = 1      # mempool intake: bounded, shed first under load
+MAX_BATCH = 64       # commands per snapshot; a block waits behind at most one batch
+
+
+class Busy(Exception):
+    """The actor's queue is full for this priority; retry later."""
+
+
+class ChainSnapshot:
+    """Immutable view of the chain and mempool published after each batch of commands."""
+
+    __slots__ = ("chain", "pending", "tip", "height")
+
+    def __init__(self, chain: Tuple[Block, ...], pending: Tuple[dict, ...]):
+        self.chain = chain
+        self.pending = pending
+        self.tip = chain[-1]
+        self.height = len(chain) - 1
+
+    def blocks_range(self, start=0, limit=None) -> List[Block]:
+        start = max(start, 0)
+        end = len(self.chain) if limit is None else start + max(limit, 0)
+        return list(self.chain[start:end])
+
+
+class ChainActor:
+    """Single owner of a Blockchain.
+
+    Every mutation is a command executed on the actor's own thread, in order, so
+    handlers never race on chain or mempool state. Readers never lock: they use
+    the latest snapshot, which is replaced (never modified) after each batch.
+
+    Commands run in priority order, first come first served within a priority.
+    Tx commands are refused with Busy once `max_backlog` commands are waiting,
+    so a flood of txs can neither grow the queue without bound nor hold up blocks.
+    """
+
+    def __init__(self, blockchain: Blockchain, max_backlog=1000):
+        self.blockchain = blockchain
+        self.max_backlog = max_backlog
+        self._commands = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._chain_len = -1
+        self._chain_tip = None
+        self.snapshot = None
+        self._publish()
+        threading.Thread(target=self._run, name="chain-actor", daemon=True).start()
+
+    def submit(self, fn, *args, priority=PRIORITY_BLOCK) -> Future:
+        """Run fn(blockchain, *args) on the actor thread."""
+        if priority != PRIORITY_BLOCK and self._commands.qsize() >= self.max_backlog:
+            raise Busy("chain actor backlog full")
+        fut = Future()
+        self._commands.put((priority, next(self._order), fn, args, fut))
+        return fut
+
+    def call(self, fn, *args, timeout=30, priority=PRIORITY_BLOCK):
+        return self.submit(fn, *args, priority=priority).result(timeout)
+
+    @property
+    def backlog(self):
+        # commands waiting for the actor thread
+        return self._commands.qsize()
+
+    def _run(self):
+        while True:
+            batch = [self._commands.get()]
+            # drain whatever queued up meanwhile; one snapshot for the whole batch
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._commands.get_nowait())
+                except queue.Empty:
+                    break
+            outcomes = []
+            for _, _, fn, args, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    outcomes.append((fut, fn(self.blockchain, *args), None))
+                except Exception as e:
+                    outcomes.append((fut, None, e))
+            # publish before resolving, so a caller always reads its own write
+            self._publish()
+            for fut, result, error in outcomes:
+                if error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(result)
+
+    def _publish(self):
+        bc = self.blockchain
+        chain = self.snapshot.chain if self.snapshot else ()
+        # the chain tuple is only rebuilt when blocks changed (new tip or reorg)
+        if len(bc.chain) != self._chain_len or bc.chain[-1] is not self._chain_tip:
+            chain = tuple(bc.chain)
+            self._chain_len, self._chain_tip = len(chain), chain[-1]
+        self.snapshot = ChainSnapshot(chain, tuple(bc.pending_transactions))
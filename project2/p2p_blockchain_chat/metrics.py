@@ -0,0 +1,125 @@
+import bisect, threading, time
+from contextlib import contextmanager
+
+# seconds; covers a cached signature check up to a slow proof of work
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _register(metric):
+    with _lock:
+        _registry.append(metric)
+    return metric
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic count, optionally split by label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, _labels(self.labelnames, k), v) for k, v in items]
+
+
+class Gauge:
+    """Value read at scrape time from a callback, so hot paths never update it."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn):
+        self.name, self.help, self.fn = name, help, fn
+        _register(self)
+
+    def samples(self):
+        try:
+            return [(self.name, "", self.fn())]
+        except Exception:
+            return []
+
+
+class Histogram:
+    """Bucketed observations (usually durations) with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.bounds = tuple(buckets)
+        self._series = {}     # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.bounds) + 2)
+            s[i] += 1
+            s[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def timed(self, fn, *labels):
+        """Wrap fn so every call is observed."""
+        def wrapper(*args, **kwargs):
+            with self.time(*labels):
+                return fn(*args, **kwargs)
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    def samples(self):
+        with self._lock:
+            series = [(k, list(v)) for k, v in self._series.items()]
+        out = []
+        for labels, s in series:
+            # exposition buckets are cumulative
+            total = 0
+            for bound, n in zip(self.bounds + ("+Inf",), s[:-1]):
+                total += n
+                out.append((self.name + "_bucket", _labels(self.labelnames, labels, ("le", bound)), total))
+            out.append((self.name + "_sum", _labels(self.labelnames, labels), s[-1]))
+            out.append((self.name + "_count", _labels(self.labelnames, labels), total))
+        return out
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in m.samples())
+    return "\n".join(lines) + "\n"
@@ -2,33 +2,44 @@ import sys
 import requests
 import tkinter as tk
 from tkinter import scrolledtext, ttk
-import json, os
+import json, os, queue, sqlite3, threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from wallet import load_private_key, decrypt_with_private
 
+# one keep-alive session shared by every request the client makes
+session = requests.Session()
+session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=8))
+
 # --- Detect or select node ---
+def probe(port):
+    url = f"http://127.0.0.1:{port}"
+    r = session.get(url + "/id", timeout=1)
+    r.raise_for_status()
+    return url, port
+
 def detect_node():
     if len(sys.argv) > 1:
         port = int(sys.argv[1])
-        url = f"http://127.0.0.1:{port}"
         try:
-            r = requests.get(url + "/id", timeout=1)
-            if r.status_code == 200:
-                print(f"✅ Connected to node at {url} (manual selection)")
-                return url, port
+            url, port = probe(port)
+            print(f"✅ Connected to node at {url} (manual selection)")
+            return url, port
         except Exception as e:
-            print(f"❌ Node not running at {url}: {e}")
+            print(f"❌ Node not running at 127.0.0.1:{port}: {e}")
             sys.exit(1)
 
-    # Otherwise auto-detect
-    for port in range(5000, 5010):
-        url = f"http://127.0.0.1:{port}"
-        try:
-            r = requests.get(url + "/id", timeout=1)
-            if r.status_code == 200:
-                print(f"✅ Auto-detected node at {url}")
-                return url, port
-        except:
-            continue
+    # Otherwise auto-detect: probe every port at once, first node to answer wins
+    ex = ThreadPoolExecutor(max_workers=10)
+    try:
+        for fut in as_completed([ex.submit(probe, port) for port in range(5000, 5010)]):
+            try:
+                url, port = fut.result()
+            except Exception:
+                continue
+            print(f"✅ Auto-detected node at {url}")
+            return url, port
+    finally:
+        ex.shutdown(wait=False)  # don't wait on probes to ports nobody answers
     print("❌ No node found. Make sure node.py is running.")
     sys.exit(1)
 
@@ -48,6 +59,79 @@ except Exception as e:
     print("❌ Could not load private key:", e)
     sys.exit(1)
 
+# --- Local message cache ---
+HISTORY_LINES = 1000   # cached messages shown at startup; older ones stay on disk
+
+class MessageCache:
+    """SQLite store of received messages keyed by tx id, plus the /inbox sync cursor.
+    Only used from the Tk thread."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS messages (
+            tx_id TEXT PRIMARY KEY, seq INTEGER, sender TEXT, status TEXT,
+            ciphertext TEXT, plaintext TEXT)""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def cursor(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key='cursor'").fetchone()
+        return int(row[0]) if row else 0
+
+    def store(self, items, cursor):
+        # ciphertexts and cursor are saved together, so a restart never skips or re-fetches
+        new, confirmed = [], []
+        for it in items:
+            tx = it["tx"]
+            row = self.db.execute("SELECT status FROM messages WHERE tx_id=?", (it["tx_id"],)).fetchone()
+            if row is None:
+                if tx is None:
+                    continue   # pruned on the node and not archived; nothing to show
+                self.db.execute("INSERT INTO messages VALUES (?,?,?,?,?,NULL)",
+                                (it["tx_id"], it["seq"], tx["from"], it["status"], tx["message"]))
+                new.append(it["tx_id"])
+            elif row[0] != it["status"]:
+                self.db.execute("UPDATE messages SET status=? WHERE tx_id=?", (it["status"], it["tx_id"]))
+                if it["status"] == "confirmed":
+                    confirmed.append(it["tx_id"])
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('cursor', ?)", (str(cursor),))
+        self.db.commit()
+        return new, confirmed
+
+    def undecrypted(self):
+        return self.db.execute(
+            "SELECT tx_id, ciphertext FROM messages WHERE plaintext IS NULL ORDER BY seq").fetchall()
+
+    def save_plaintexts(self, results):
+        self.db.executemany("UPDATE messages SET plaintext=? WHERE tx_id=?",
+                            [(pt, tid) for tid, pt in results])
+        self.db.commit()
+
+    def message(self, tx_id):
+        return self.db.execute(
+            "SELECT tx_id, sender, status, plaintext FROM messages WHERE tx_id=?", (tx_id,)).fetchone()
+
+    def recent(self, n):
+        rows = self.db.execute("""SELECT tx_id, sender, status, plaintext FROM messages
+            WHERE plaintext IS NOT NULL ORDER BY seq DESC LIMIT ?""", (n,)).fetchall()
+        return rows[::-1]
+
+    def reset(self):
+        self.db.execute("DELETE FROM meta WHERE key='cursor'")
+        self.db.commit()
+
+
+def decrypt_batch(batch):
+    out = []
+    for tid, ct in batch:
+        try:
+            out.append((tid, decrypt_with_private(priv, ct)))
+        except Exception:
+            out.append((tid, "[Decryption failed]"))
+    return out
+# runs on the decrypt pool; the Tk thread picks the results up from a queue
+
 # --- Tkinter UI ---
 class ChatClient:
     def __init__(self, root):
@@ -87,17 +171,60 @@ class ChatClient:
 
         self.my_log.insert(tk.END, f"Connected to {NODE}\n")
 
-    def fetch_peers(self):
+        self.cache = MessageCache(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                               f"inbox_{NODE_PORT}.db"))
+        # all network and crypto work runs off the Tk thread; results come back
+        # through ui_queue, which pump() drains on the Tk thread via root.after
+        self.io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="io")
+        self.decrypt_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="decrypt")
+        self.ui_queue = queue.Queue()
+        self.peer_keys = {}          # peer url -> public key, cached for the session
+        self.inbox_busy = False
+        for row in self.cache.recent(HISTORY_LINES):
+            self.show_message(*row)
+        # anything fetched but not decrypted before the last exit
+        self.decrypt(self.cache.undecrypted())
+
+    def run_async(self, work, on_done, on_error=None):
+        def done(fut):
+            try:
+                result = fut.result()
+            except Exception as e:
+                if on_error:
+                    # bound now: `e` is unset once the except block ends
+                    self.ui_queue.put(lambda e=e: on_error(e))
+                return
+            self.ui_queue.put(lambda: on_done(result))
+        self.io_pool.submit(work).add_done_callback(done)
+
+    def pump(self):
+        # a failing callback must not stop the pump, or every later result is lost
         try:
-            r = requests.get(f"{NODE}/peers")
-            peer_list = r.json()
+            while not self.ui_queue.empty():
+                callback = self.ui_queue.get_nowait()
+                try:
+                    callback()
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            self.root.after(50, self.pump)
+
+    def fetch_peers(self):
+        def work():
+            return [p["url"] for p in session.get(f"{NODE}/peers", timeout=5).json() if p["state"] != "open"]
+        def done(peer_list):
             if not peer_list:
                 self.my_log.insert(tk.END, "⚠️ No peers found.\n")
             else:
                 self.peer_selector["values"] = peer_list
                 self.my_log.insert(tk.END, "Peers: " + str(peer_list) + "\n")
-        except Exception as e:
-            self.my_log.insert(tk.END, f"Error fetching peers: {e}\n")
+        self.run_async(work, done, lambda e: self.my_log.insert(tk.END, f"Error fetching peers: {e}\n"))
+
+    def peer_key(self, peer_url):
+        # runs on the io pool
+        if peer_url not in self.peer_keys:
+            self.peer_keys[peer_url] = session.get(f"{peer_url}/id", timeout=5).json()["public_key"]
+        return self.peer_keys[peer_url]
 
     def send_message(self):
         text = self.entry.get().strip()
@@ -107,238 +234,119 @@ class ChatClient:
         if not peer_url:
             self.my_log.insert(tk.END, "⚠️ Select a peer first!\n")
             return
-        try:
-            id_info = requests.get(f"{peer_url}/id").json()
+        self.entry.delete(0, tk.END)
+        def work():
             payload = {
                 "to_node": peer_url,
-                "to_pub": id_info["public_key"],
+                "to_pub": self.peer_key(peer_url),
                 "message": text,
             }
-            r = requests.post(f"{NODE}/send", json=payload)
+            return session.post(f"{NODE}/send", json=payload, timeout=10)
+        def done(r):
             if r.status_code == 200:
                 self.my_log.insert(tk.END, f"You → {peer_url}: {text}\n")
-                self.entry.delete(0, tk.END)
             else:
                 self.my_log.insert(tk.END, f"Error sending: {r.text}\n")
-        except Exception as e:
-            self.my_log.insert(tk.END, f"Send failed: {e}\n")
+        self.run_async(work, done, lambda e: self.my_log.insert(tk.END, f"Send failed: {e}\n"))
 
     def mine_block(self):
-        try:
-            r = requests.post(f"{NODE}/mine")
+        def done(r):
             if r.status_code == 201:
                 self.my_log.insert(tk.END, "⛏️ Block mined!\n")
             else:
                 self.my_log.insert(tk.END, f"Mining: {r.json()}\n")
-        except Exception as e:
-            self.my_log.insert(tk.END, f"Mining failed: {e}\n")
+        self.run_async(lambda: session.post(f"{NODE}/mine", timeout=120), done,
+                       lambda e: self.my_log.insert(tk.END, f"Mining failed: {e}\n"))
 
     def fetch_inbox(self):
-        try:
-            r = requests.get(f"{NODE}/chain")
-            chain = r.json()
-            self.peer_log.delete(1.0, tk.END)
-            self.peer_log.insert(tk.END, "📥 Incoming Messages\n")
-            for block in chain:
-                for tx in block.get("transactions", []):
-                    if tx.get("to") == NODE:  # message meant for me
-                        try:
-                            plaintext = decrypt_with_private(priv, tx["message"])
-                        except Exception:
-                            plaintext = "[Decryption failed]"
-                        self.peer_log.insert(tk.END, f"{tx['from']} → You: {plaintext}\n")
-        except Exception as e:
+        # only what changed since our cursor: new messages and status changes
+        if self.inbox_busy:
+            return
+        self.inbox_busy = True
+        cursor = self.cache.cursor()
+        def work():
+            pages, since = [], cursor
+            while True:
+                page = session.get(f"{NODE}/inbox", params={"to": NODE, "since": since}, timeout=5).json()
+                pages.append(page)
+                since = page["cursor"]
+                if not page["more"]:
+                    return pages
+        def done(pages):
+            self.inbox_busy = False
+            for page in pages:
+                if page["reset"]:
+                    self.cache.reset()   # node restarted; replay, tx ids dedupe
+                new, confirmed = self.cache.store(page["items"], page["cursor"])
+                for tid in confirmed:
+                    self.mark_confirmed(tid)
+                self.decrypt([(it["tx_id"], it["tx"]["message"]) for it in page["items"]
+                              if it["tx_id"] in new])
+        def failed(e):
+            self.inbox_busy = False
             self.peer_log.insert(tk.END, f"Error fetching inbox: {e}\n")
+        self.run_async(work, done, failed)
 
+    def decrypt(self, batch, size=50):
+        for i in range(0, len(batch), size):
+            fut = self.decrypt_pool.submit(decrypt_batch, batch[i:i + size])
+            fut.add_done_callback(lambda f: self.ui_queue.put(lambda: self.on_decrypted(f.result())))
 
-if __name__ == "__main__":
-    root = tk.Tk()
-    app = ChatClient(root)
-
-    # auto-refresh inbox every 5 seconds
-    def refresh_inbox():
-        app.fetch_inbox()
-        root.after(5000, refresh_inbox)
-
-    refresh_inbox()
-    root.mainloop()
-import sys
-import requests
-import tkinter as tk
-from tkinter import scrolledtext, ttk
-import json, os
-from wallet import load_private_key, decrypt_with_private
-
-# --- Detect or select node ---
-def detect_node():
-    if len(sys.argv) > 1:
-        port = int(sys.argv[1])
-        url = f"http://127.0.0.1:{port}"
-        try:
-            r = requests.get(url + "/id", timeout=1)
-            if r.status_code == 200:
-                print(f"✅ Connected to node at {url} (manual selection)")
-                return url, port
-        except Exception as e:
-            print(f"❌ Node not running at {url}: {e}")
-            sys.exit(1)
-
-    # Otherwise auto-detect
-    for port in range(5000, 5010):
-        url = f"http://127.0.0.1:{port}"
-        try:
-            r = requests.get(url + "/id", timeout=1)
-            if r.status_code == 200:
-                print(f"✅ Auto-detected node at {url}")
-                return url, port
-        except:
-            continue
-    print("❌ No node found. Make sure node.py is running.")
-    sys.exit(1)
-
-NODE, NODE_PORT = detect_node()
-
-# --- Load private key for this node ---
-try:
-    key_file = os.path.join(os.path.dirname(__file__), f"node_keys_{NODE_PORT}.json")
-    if not os.path.exists(key_file):
-        key_file = os.path.join(os.path.dirname(__file__), "node_keys.json")
-
-    with open(key_file, "r") as f:
-        saved = json.load(f)
-    priv = load_private_key(saved["private"])
-    print(f"🔑 Loaded key from {key_file}")
-except Exception as e:
-    print("❌ Could not load private key:", e)
-    sys.exit(1)
-
-# --- Tkinter UI ---
-class ChatClient:
-    def __init__(self, root):
-        self.root = root
-        self.root.title(f"Blockchain Chat Client – {NODE}")
-
-        # Two panes: outgoing & incoming
-        frame = tk.Frame(root)
-        frame.pack(padx=10, pady=10)
-
-        self.my_log = scrolledtext.ScrolledText(frame, wrap=tk.WORD, width=40, height=20, fg="green")
-        self.my_log.pack(side=tk.LEFT, padx=5)
-        self.my_log.insert(tk.END, "📤 Outgoing Messages\n")
-
-        self.peer_log = scrolledtext.ScrolledText(frame, wrap=tk.WORD, width=40, height=20, fg="blue")
-        self.peer_log.pack(side=tk.LEFT, padx=5)
-        self.peer_log.insert(tk.END, "📥 Incoming Messages\n")
-
-        # Input & controls
-        bottom = tk.Frame(root)
-        bottom.pack(pady=5)
-
-        self.entry = tk.Entry(bottom, width=40)
-        self.entry.pack(side=tk.LEFT, padx=5)
-
-        self.send_btn = tk.Button(bottom, text="Send", command=self.send_message)
-        self.send_btn.pack(side=tk.LEFT, padx=5)
+    def on_decrypted(self, results):
+        # Tk thread: persist finished plaintexts and append just those lines
+        self.cache.save_plaintexts(results)
+        for tid, _ in results:
+            self.show_message(*self.cache.message(tid))
 
-        self.mine_btn = tk.Button(bottom, text="Mine", command=self.mine_block)
-        self.mine_btn.pack(side=tk.LEFT, padx=5)
+    def show_message(self, tx_id, sender, status, plaintext):
+        if status == "pending":
+            self.peer_log.insert(tk.END, "(pending) ", ("p" + tx_id,))
+        self.peer_log.insert(tk.END, f"{sender} → You: {plaintext}\n")
+        self.peer_log.see(tk.END)
 
-        self.refresh_btn = tk.Button(bottom, text="Peers", command=self.fetch_peers)
-        self.refresh_btn.pack(side=tk.LEFT, padx=5)
+    def mark_confirmed(self, tx_id):
+        ranges = self.peer_log.tag_ranges("p" + tx_id)
+        if ranges:
+            self.peer_log.delete(ranges[0], ranges[1])
 
-        self.peer_selector = ttk.Combobox(bottom, width=30)
-        self.peer_selector.pack(side=tk.LEFT, padx=5)
 
-        self.my_log.insert(tk.END, f"Connected to {NODE}\n")
+# --- Event stream: refresh as soon as the node reports a tx or block ---
+inbox_dirty = threading.Event()
 
-    def fetch_peers(self):
+def watch_events():
+    last_id = None
+    while True:
         try:
-            r = requests.get(f"{NODE}/peers")
-            peer_list = r.json()
-            if not peer_list:
-                self.my_log.insert(tk.END, "⚠️ No peers found.\n")
-            else:
-                self.peer_selector["values"] = peer_list
-                self.my_log.insert(tk.END, "Peers: " + str(peer_list) + "\n")
-        except Exception as e:
-            self.my_log.insert(tk.END, f"Error fetching peers: {e}\n")
-
-    def send_message(self):
-        text = self.entry.get().strip()
-        peer_url = self.peer_selector.get().strip()
-        if not text:
-            return
-        if not peer_url:
-            self.my_log.insert(tk.END, "⚠️ Select a peer first!\n")
-            return
-        try:
-            id_info = requests.get(f"{peer_url}/id").json()
-            payload = {
-                "to_node": peer_url,
-                "to_pub": id_info["public_key"],
-                "message": text,
-            }
-            r = requests.post(f"{NODE}/send", json=payload)
-            if r.status_code == 200:
-                self.my_log.insert(tk.END, f"You → {peer_url}: {text}\n")
-                self.entry.delete(0, tk.END)
-            else:
-                self.my_log.insert(tk.END, f"Error sending: {r.text}\n")
-        except Exception as e:
-            self.my_log.insert(tk.END, f"Send failed: {e}\n")
-
-    def mine_block(self):
-        try:
-            r = requests.post(f"{NODE}/mine")
-            if r.status_code == 201:
-                self.my_log.insert(tk.END, "⛏️ Block mined!\n")
-            else:
-                self.my_log.insert(tk.END, f"Mining: {r.json()}\n")
-        except Exception as e:
-            self.my_log.insert(tk.END, f"Mining failed: {e}\n")
-
-    def fetch_inbox(self):
-        self.peer_log.delete(1.0, tk.END)
-        self.peer_log.insert(tk.END, "📥 Incoming Messages\n")
-
-        # Confirmed (mined) messages
-        try:
-            r = requests.get(f"{NODE}/chain")
-            chain = r.json()
-            for block in chain:
-                for tx in block.get("transactions", []):
-                    if tx.get("to") == NODE:  # message meant for me
-                        try:
-                            plaintext = decrypt_with_private(priv, tx["message"])
-                        except Exception:
-                            plaintext = "[Decryption failed]"
-                        self.peer_log.insert(tk.END, f"{tx['from']} → You: {plaintext}\n")
-        except Exception as e:
-            self.peer_log.insert(tk.END, f"Error fetching chain: {e}\n")
-
-        # Pending (unmined) messages
-        try:
-            r = requests.get(f"{NODE}/pending")
-            pending = r.json()
-            for tx in pending:
-                if tx.get("to") == NODE:
-                    try:
-                        plaintext = decrypt_with_private(priv, tx["message"])
-                    except Exception:
-                        plaintext = "[Decryption failed]"
-                    self.peer_log.insert(tk.END, f"(pending) {tx['from']} → You: {plaintext}\n")
-        except Exception as e:
-            self.peer_log.insert(tk.END, f"Error fetching pending: {e}\n")
+            headers = {"Last-Event-ID": last_id} if last_id else {}
+            with session.get(f"{NODE}/events", params={"types": "new_tx,new_block,reorg"},
+                              headers=headers, stream=True, timeout=30) as r:
+                for line in r.iter_lines():
+                    if line.startswith(b"id:"):
+                        last_id = line[3:].strip().decode()
+                    elif line.startswith(b"event:"):
+                        inbox_dirty.set()
+        except Exception:
+            time.sleep(2)  # node restarting or unreachable; reconnect and resume
 
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = ChatClient(root)
 
-    # auto-refresh inbox every 5 seconds
+    # Tk is single-threaded: the watcher only sets a flag, coalescing bursts of
+    # events into one refresh; a slow full refresh remains as a fallback
+    def check_events():
+        if inbox_dirty.is_set():
+            inbox_dirty.clear()
+            app.fetch_inbox()
+        root.after(250, check_events)
+
     def refresh_inbox():
         app.fetch_inbox()
-        root.after(5000, refresh_inbox)
+        root.after(30000, refresh_inbox)
 
+    threading.Thread(target=watch_events, daemon=True).start()
+    app.pump()
     refresh_inbox()
+    check_events()
     root.mainloop()
@@ -0,0 +1,67 @@
+import base64, json
+
+try:
+    import msgpack
+except ImportError:  # JSON-only node; peers fall back automatically
+    msgpack = None
+
+BINARY_TYPE = "application/msgpack"
+JSON_TYPE = "application/json"
+
+# base64 text fields that travel as raw bytes in the binary encoding
+BYTES_FIELDS = {"message", "signature", "sender_pub", "public_key", "short_ids"}
+
+
+class UnsupportedType(ValueError):
+    """Body is in an encoding this node cannot read (msgpack without the library)."""
+
+
+def binary_available():
+    return msgpack is not None
+
+
+def _raw(v):
+    # only canonical base64 round-trips exactly; anything else stays text
+    try:
+        raw = base64.b64decode(v, validate=True)
+    except ValueError:
+        return v
+    return raw if base64.b64encode(raw).decode() == v else v
+
+
+def _to_wire(obj):
+    if isinstance(obj, dict):
+        return {k: _raw(v) if k in BYTES_FIELDS and isinstance(v, str) else _to_wire(v)
+                for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_to_wire(v) for v in obj]
+    return obj
+
+
+def _from_wire(obj):
+    if isinstance(obj, dict):
+        return {k: base64.b64encode(v).decode() if isinstance(v, bytes) else _from_wire(v)
+                for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_from_wire(v) for v in obj]
+    return obj
+
+
+def encode(obj, binary=True) -> bytes:
+    if binary and msgpack is not None:
+        return msgpack.packb(_to_wire(obj), use_bin_type=True)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def decode(data: bytes, content_type: str):
+    if content_type and content_type.startswith(BINARY_TYPE):
+        if msgpack is None:
+            raise UnsupportedType("binary encoding not supported")
+        return _from_wire(msgpack.unpackb(data, raw=False))
+    return json.loads(data)
+
+
+def pack_array(items) -> bytes:
+    # msgpack array of already-packed elements, so cached block bytes can be reused
+    items = list(items)
+    return msgpack.Packer().pack_array_header(len(items)) + b"".join(items)
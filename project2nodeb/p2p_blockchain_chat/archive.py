@@ -0,0 +1,57 @@
+import os, threading, zlib
+from functools import lru_cache
+
+import wire
+
+READ_CACHE = 64   # recently read blocks kept decompressed
+
+
+class BlockArchive:
+    """Cold store for the tx bodies of pruned blocks.
+
+    Bodies are appended zlib-compressed (msgpack when available, so base64 fields
+    are stored as raw bytes) to one file; only an offset per block stays in
+    memory. The chain lives in memory and is resynced on restart, so the file
+    is started afresh each run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "w+b")
+        self._index = {}     # block hash -> (offset, length, binary)
+        self._lock = threading.Lock()
+        self.get = lru_cache(maxsize=READ_CACHE)(self._read)
+
+    def on_chain_event(self, kind, data):
+        # Blockchain listener: archive bodies just before the block drops them
+        if kind == "prune" and data.transactions is not None:
+            self.put(data)
+
+    def put(self, block):
+        binary = wire.binary_available()
+        blob = zlib.compress(wire.encode(block.transactions, binary))
+        with self._lock:
+            self._f.seek(0, os.SEEK_END)
+            offset = self._f.tell()
+            self._f.write(blob)
+            self._index[block.hash] = (offset, len(blob), binary)
+
+    def _read(self, block_hash):
+        """Transactions of an archived block, or None if it was never archived."""
+        with self._lock:
+            entry = self._index.get(block_hash)
+            if entry is None:
+                return None
+            offset, length, binary = entry
+            self._f.flush()
+            self._f.seek(offset)
+            blob = self._f.read(length)
+        return wire.decode(zlib.decompress(blob), wire.BINARY_TYPE if binary else wire.JSON_TYPE)
+
+    def __contains__(self, block_hash):
+        return block_hash in self._index
+
+    def size(self):
+        with self._lock:
+            self._f.seek(0, os.SEEK_END)
+            return self._f.tell()
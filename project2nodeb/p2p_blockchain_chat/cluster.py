@@ -0,0 +1,299 @@
+"""Start N local nodes, wire them into a topology and drive /send load at them.
+
+    python cluster.py --nodes 8 --topology ring --rate 50 --duration 30 --mine-interval 2
+
+Each node runs as its own node.py process in a scratch directory (its key file
+lands there). The harness follows every node's /events stream to time when
+each tx reaches each node and when it is confirmed, and reads per-process CPU
+time from /proc (or psutil). Results are printed and, with --json, saved.
+"""
+import argparse, json, os, random, signal, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from blockchain import tx_id
+
+try:
+    import psutil
+except ImportError:  # /proc is enough on Linux
+    psutil = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+# ---- topology ----
+def seeds(i, n, topology, degree):
+    """Indexes of the peers node i starts with."""
+    others = [j for j in range(n) if j != i]
+    if topology == "full":
+        return others
+    if topology == "star":
+        return others if i == 0 else [0]
+    if topology == "ring":
+        return sorted({(i - 1) % n, (i + 1) % n} - {i})
+    if topology == "line":
+        return [j for j in (i - 1, i + 1) if 0 <= j < n]
+    # random: every node dials `degree` others; links are made both ways below
+    return random.Random(i).sample(others, min(degree, len(others)))
+
+
+def links(n, topology, degree):
+    adj = {i: set() for i in range(n)}
+    for i in range(n):
+        for j in seeds(i, n, topology, degree):
+            adj[i].add(j)
+            adj[j].add(i)
+    return adj
+
+
+# ---- processes ----
+class Cluster:
+    def __init__(self, n, base_port, topology, degree, workdir, gossip_interval):
+        self.urls = [f"http://127.0.0.1:{base_port + i}" for i in range(n)]
+        self.procs = []
+        adj = links(n, topology, degree)
+        for i, url in enumerate(self.urls):
+            d = os.path.join(workdir, f"node{i}")
+            os.makedirs(d, exist_ok=True)
+            env = dict(os.environ,
+                       PORT=str(base_port + i), NODE_URL=url,
+                       PEERS=",".join(self.urls[j] for j in sorted(adj[i])),
+                       # gossip off keeps the chosen topology fixed
+                       GOSSIP_INTERVAL=str(gossip_interval or 10 ** 9),
+                       # all load comes from this one address; per-client limits would cap it
+                       CLIENT_RATE=os.environ.get("CLIENT_RATE", "0"))
+            log = open(os.path.join(d, "node.log"), "wb")
+            self.procs.append(subprocess.Popen([sys.executable, os.path.join(HERE, "node.py")],
+                                               cwd=d, env=env, stdout=log, stderr=subprocess.STDOUT))
+
+    def wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        for url, p in zip(self.urls, self.procs):
+            while True:
+                if p.poll() is not None:
+                    raise RuntimeError(f"{url} exited with {p.returncode}")
+                try:
+                    requests.get(f"{url}/health", timeout=1).raise_for_status()
+                    break
+                except requests.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError(f"{url} did not come up")
+                    time.sleep(0.2)
+
+    def cpu_seconds(self):
+        return [cpu_time(p.pid) for p in self.procs]
+
+    def stop(self):
+        for p in self.procs:
+            if p.poll() is None:
+                p.send_signal(signal.SIGTERM)
+        for p in self.procs:
+            try:
+                p.wait(5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+def cpu_time(pid):
+    # user + system seconds of a process
+    if psutil is not None:
+        t = psutil.Process(pid).cpu_times()
+        return t.user + t.system
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLK_TCK
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+# ---- observation ----
+class Observer:
+    """Follows each node's /events stream and records when txs and blocks arrive."""
+
+    def __init__(self, urls):
+        self.urls = urls
+        self.lock = threading.Lock()
+        self.tx_seen = {}        # tx_id -> {node: first time the node had it}
+        self.confirmed = {}      # tx_id -> {node: time its block arrived}
+        self.block_seen = {}     # block hash -> {node: time}
+        self.ready = threading.Barrier(len(urls) + 1)
+        for i, url in enumerate(urls):
+            threading.Thread(target=self.follow, args=(i, url), daemon=True).start()
+        self.ready.wait(10)
+
+    def follow(self, node, url):
+        r = requests.get(f"{url}/events", params={"types": "new_tx,new_block"}, stream=True, timeout=None)
+        self.ready.wait()
+        kind = None
+        try:
+            for line in r.iter_lines():
+                if line.startswith(b"event:"):
+                    kind = line[6:].strip().decode()
+                elif line.startswith(b"data:"):
+                    self.record(node, kind, json.loads(line[5:]), time.time())
+        except requests.RequestException:
+            pass  # node stopped
+
+    def record(self, node, kind, data, now):
+        with self.lock:
+            if kind == "new_tx":
+                self.tx_seen.setdefault(tx_id(data), {}).setdefault(node, now)
+            elif kind == "new_block":
+                self.block_seen.setdefault(data["hash"], {}).setdefault(node, now)
+                for tx in data.get("transactions", ()):
+                    tid = tx_id(tx)
+                    self.tx_seen.setdefault(tid, {}).setdefault(node, now)
+                    self.confirmed.setdefault(tid, {}).setdefault(node, now)
+
+
+# ---- load ----
+class Load:
+    def __init__(self, cluster, rate, duration, concurrency):
+        self.urls = cluster.urls
+        self.rate, self.duration = rate, duration
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.local = threading.local()
+        self.pubs = [requests.get(f"{u}/id", timeout=5).json()["public_key"] for u in self.urls]
+        self.sent = {}           # tx_id -> (submit time, origin node, recipient node)
+        self.latencies = []      # /send request latency
+        self.errors = 0
+        self.throttled = 0       # 429s: the node shed the request
+        self.lock = threading.Lock()
+
+    def session(self):
+        if not hasattr(self.local, "s"):
+            self.local.s = requests.Session()
+        return self.local.s
+
+    def send_one(self, k):
+        origin = random.randrange(len(self.urls))
+        to = random.randrange(len(self.urls))
+        body = {"to_node": self.urls[to], "to_pub": self.pubs[to], "message": f"load {k} {time.time()}"}
+        start = time.time()
+        try:
+            r = self.session().post(f"{self.urls[origin]}/send", json=body, timeout=30)
+            if r.status_code == 429:
+                with self.lock:
+                    self.throttled += 1
+                return
+            r.raise_for_status()
+            tid = r.json()["tx_id"]
+        except (requests.RequestException, KeyError, ValueError):
+            with self.lock:
+                self.errors += 1
+            return
+        with self.lock:
+            self.sent[tid] = (start, origin, to)
+            self.latencies.append(time.time() - start)
+
+    def run(self):
+        # open loop: txs go out on schedule whether or not earlier ones finished
+        start = time.time()
+        total = int(self.rate * self.duration)
+        for k in range(total):
+            delay = start + k / self.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.pool.submit(self.send_one, k)
+        self.pool.shutdown(wait=True)
+        return time.time() - start
+
+
+def mine_loop(urls, interval, stop):
+    s = requests.Session()
+    while not stop.wait(interval):
+        try:
+            s.post(f"{random.choice(urls)}/mine", timeout=60)
+        except requests.RequestException:
+            pass
+
+
+# ---- report ----
+def percentiles(values, ps=(50, 95, 99)):
+    if not values:
+        return {f"p{p}": None for p in ps}
+    values = sorted(values)
+    # nearest rank
+    return {f"p{p}": round(values[min(len(values) - 1, max(0, -(-p * len(values) // 100) - 1))] * 1000, 1)
+            for p in ps}
+
+
+def report(load, obs, n, elapsed, window, cpu):
+    with obs.lock:
+        reach, confirm = [], []
+        for tid, (start, origin, to) in load.sent.items():
+            seen = obs.tx_seen.get(tid, {})
+            if len(seen) == n:
+                reach.append(max(seen.values()) - start)
+            done = obs.confirmed.get(tid, {}).get(to)
+            if done is not None:
+                confirm.append(done - start)
+        blocks = [max(t.values()) - min(t.values()) for t in obs.block_seen.values() if len(t) == n]
+    return {
+        "nodes": n,
+        "sent": len(load.sent) + load.errors + load.throttled,
+        "accepted": len(load.sent),
+        "throttled": load.throttled,
+        "errors": load.errors,
+        "accepted_tps": round(len(load.sent) / elapsed, 1),
+        "send_latency_ms": percentiles(load.latencies),
+        "tx_propagation_ms": percentiles(reach),
+        "tx_reached_all": len(reach),
+        "confirmation_ms": percentiles(confirm),
+        "confirmed": len(confirm),
+        "block_propagation_ms": percentiles(blocks),
+        "blocks": len(obs.block_seen),
+        "cpu_seconds": cpu,
+        "cpu_percent": [round(c / window * 100, 1) if c is not None else None for c in cpu],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--nodes", type=int, default=4)
+    ap.add_argument("--base-port", type=int, default=7001)
+    ap.add_argument("--topology", choices=["full", "ring", "line", "star", "random"], default="random")
+    ap.add_argument("--degree", type=int, default=3, help="links per node for --topology random")
+    ap.add_argument("--gossip-interval", type=float, default=0,
+                    help="seconds between membership swaps; 0 keeps the topology fixed")
+    ap.add_argument("--rate", type=float, default=20, help="target /send requests per second")
+    ap.add_argument("--duration", type=float, default=20, help="seconds of load")
+    ap.add_argument("--concurrency", type=int, default=16, help="in-flight /send requests")
+    ap.add_argument("--mine-interval", type=float, default=2, help="seconds between /mine calls")
+    ap.add_argument("--drain", type=float, default=10, help="seconds to keep mining after the load")
+    ap.add_argument("--workdir", help="node directories (default: a temp dir)")
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cluster-")
+    cluster = Cluster(args.nodes, args.base_port, args.topology, args.degree, workdir, args.gossip_interval)
+    stop = threading.Event()
+    try:
+        cluster.wait_ready()
+        print(f"{args.nodes} nodes up ({args.topology}), logs in {workdir}")
+        obs = Observer(cluster.urls)
+        load = Load(cluster, args.rate, args.duration, args.concurrency)
+        threading.Thread(target=mine_loop, args=(cluster.urls, args.mine_interval, stop), daemon=True).start()
+
+        cpu_before = cluster.cpu_seconds()
+        elapsed = load.run()
+        time.sleep(args.drain)
+        cpu = [round(b - a, 2) if a is not None and b is not None else None
+               for a, b in zip(cpu_before, cluster.cpu_seconds())]
+        results = report(load, obs, args.nodes, elapsed, elapsed + args.drain, cpu)
+    finally:
+        stop.set()
+        cluster.stop()
+
+    for k, v in results.items():
+        print(f"{k:>22}: {v}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import json, threading
+from collections import deque
+from itertools import islice
+
+EVENT_BUFFER = 10000     # events kept for clients resuming with Last-Event-ID
+KEEPALIVE = 15           # seconds between SSE comments on an idle stream
+
+
+class EventLog:
+    """Numbered, bounded log of node events that SSE clients can resume from."""
+
+    def __init__(self, size=EVENT_BUFFER):
+        self._events = deque(maxlen=size)   # (seq, kind, encoded data)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def publish(self, kind, data):
+        # encode once here instead of once per connected client
+        if not isinstance(data, bytes):
+            data = json.dumps(data, separators=(",", ":")).encode()
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, kind, data))
+            self._cond.notify_all()
+            return self._seq
+
+    def since(self, seq):
+        """Events after seq, or None if seq already fell out of the buffer."""
+        with self._cond:
+            if seq > self._seq:
+                return None   # cursor from before a node restart
+            if not self._events:
+                return []
+            first = self._events[0][0]
+            if seq < first - 1:
+                return None
+            # seqs in the buffer are contiguous, so skip straight to seq + 1
+            return list(islice(self._events, max(0, seq - first + 1), None))
+
+    def wait(self, seq, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq, timeout)
+
+    def stream(self, seq, kinds=None):
+        """Generator of SSE frames starting after seq; blocks waiting for new events."""
+        # servers send headers with the first chunk, so don't wait for an event
+        yield b": connected\n\n"
+        while True:
+            events = self.since(seq)
+            if events is None:
+                # client was away too long: tell it to refetch state, then follow live
+                seq = self._seq
+                yield f"id: {seq}\nevent: reset\ndata: {{}}\n\n".encode()
+                continue
+            for s, kind, data in events:
+                seq = s
+                if kinds is None or kind in kinds:
+                    yield f"id: {s}\nevent: {kind}\ndata: ".encode() + data + b"\n\n"
+            if not events:
+                self.wait(seq, KEEPALIVE)
+                if self._seq == seq:
+                    yield b": keepalive\n\n"
@@ -0,0 +1,109 @@
+import base64, hashlib, math, threading, time
+from collections import OrderedDict
+
+from blockchain import Block, tx_id
+
+PEER_VIEW = 32        # peers each node keeps in its partial view
+SHUFFLE_SIZE = 8      # peers swapped per membership exchange
+MIN_FANOUT = 3
+SEEN_SIZE = 100000    # tx ids / block hashes remembered for relay dedup
+REQUEST_TTL = 5.0     # seconds before an announced id may be requested again
+SHORT_ID_BYTES = 6
+RESYNC_TXS = 1000     # newest mempool ids re-announced to each gossip partner
+
+
+def fanout(view_size, override=0):
+    """Peers each message is pushed to: about log2 of the view, never the whole view.
+
+    The view is capped at PEER_VIEW, so outbound traffic per node stays the same
+    however large the cluster grows; with epidemic push every node still gets the
+    message within O(log N) hops.
+    """
+    if override:
+        return min(override, view_size)
+    return min(view_size, max(MIN_FANOUT, math.ceil(math.log2(view_size + 1))))
+
+
+class SeenCache:
+    """Bounded set of message ids already handled, oldest forgotten first."""
+
+    def __init__(self, size=SEEN_SIZE):
+        self._ids = OrderedDict()
+        self._size = size
+        self._lock = threading.Lock()
+
+    def add(self, mid) -> bool:
+        # True the first time an id is seen; relays of it after that are dropped
+        with self._lock:
+            if mid in self._ids:
+                self._ids.move_to_end(mid)
+                return False
+            self._ids[mid] = None
+            if len(self._ids) > self._size:
+                self._ids.popitem(last=False)
+            return True
+
+    def discard(self, mid):
+        # an id taken but not handled after all (shed under load), so it may come again
+        with self._lock:
+            self._ids.pop(mid, None)
+
+    def __contains__(self, mid):
+        return mid in self._ids
+
+
+class InFlight:
+    """Ids already requested after an announcement, so several peers announcing
+    the same tx at once only get it fetched once (again after REQUEST_TTL)."""
+
+    def __init__(self, ttl=REQUEST_TTL):
+        self._at = {}
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def claim(self, ids):
+        now = time.time()
+        with self._lock:
+            if len(self._at) > SEEN_SIZE:
+                self._at = {i: t for i, t in self._at.items() if now - t < self._ttl}
+            wanted = [i for i in ids if now - self._at.get(i, 0) >= self._ttl]
+            for i in wanted:
+                self._at[i] = now
+            return wanted
+
+
+# ---- compact blocks ----
+def short_id(block_hash, tid):
+    # salted with the block hash so a collision in one block says nothing about the next
+    return hashlib.sha256((block_hash + tid).encode()).digest()[:SHORT_ID_BYTES]
+
+def compact_block(block: Block):
+    """Header plus a short id per tx: a few bytes per tx instead of the tx itself."""
+    sids = b"".join(short_id(block.hash, tid) for tid in block.tx_ids)
+    return dict(block.header(), short_ids=base64.b64encode(sids).decode())
+
+def rebuild_block(compact, pending, prefill=None):
+    """Rebuild a block from its compact form and our mempool.
+
+    Returns (block, missing): missing lists the tx positions we could not fill,
+    and block is None until all are filled. prefilled txs win over the mempool.
+    """
+    prefill = prefill or {}
+    block_hash = compact["hash"]
+    by_sid = {short_id(block_hash, tx_id(tx)): tx for tx in pending}
+    sids = base64.b64decode(compact["short_ids"])
+    txs, missing = [], []
+    for i in range(0, len(sids), SHORT_ID_BYTES):
+        pos = i // SHORT_ID_BYTES
+        tx = prefill.get(pos) or by_sid.get(sids[i:i + SHORT_ID_BYTES])
+        if tx is None:
+            missing.append(pos)
+        txs.append(tx)
+    if missing:
+        return None, missing
+    block = Block(compact["index"], compact["timestamp"], txs, compact["prev_hash"], compact["nonce"])
+    block.hash = block_hash
+    if block.compute_hash() != block_hash:
+        # short id collision: ask for every tx that came from the mempool
+        return None, [pos for pos in range(len(txs)) if pos not in prefill]
+    return block, []
@@ -0,0 +1,91 @@
+import bisect, threading
+from collections import defaultdict
+
+from blockchain import tx_id
+
+MAX_QUERY = 5000   # most items one query returns
+
+
+class InboxIndex:
+    """Secondary indexes of transactions by recipient and by sender.
+
+    Every index write gets a new sequence number, so a client holding the last
+    sequence it saw (its cursor) can ask for exactly what changed since: new
+    pending txs, and txs that got confirmed (or were un-confirmed by a reorg).
+    Clients upsert items by tx_id, keeping the latest status.
+    """
+
+    def __init__(self, load=None):
+        self._seq = 0
+        self._by_to = defaultdict(list)     # address -> [(seq, tx_id, status, height)]
+        self._by_from = defaultdict(list)
+        self._txs = {}                      # tx_id -> tx, None once its block is pruned
+        self._pruned = {}                   # tx_id -> height of the pruned block holding it
+        self._lock = threading.Lock()
+        self._load = load                   # (tx_id, height) -> tx from cold storage, or None
+
+    def on_chain_event(self, kind, data):
+        # Blockchain listener
+        if kind == "tx":
+            self._add([data], "pending", None)
+        elif kind == "block":
+            # blocks synced without bodies have nothing to index
+            if data.transactions is not None:
+                self._add(data.transactions, "confirmed", data.index)
+        elif kind == "reorg":
+            # txs of dropped blocks go back to the mempool; any the new branch
+            # confirms get a confirmed entry again right after
+            self._add([t for b in data for t in b.transactions], "pending", None)
+        elif kind == "prune":
+            with self._lock:
+                for tid in data.tx_ids:
+                    if tid in self._txs:
+                        self._txs[tid] = None
+                        self._pruned[tid] = data.index
+
+    def _add(self, txs, status, height):
+        with self._lock:
+            for tx in txs:
+                if not isinstance(tx, dict):
+                    continue
+                tid = tx_id(tx)
+                self._txs[tid] = tx
+                self._seq += 1
+                entry = (self._seq, tid, status, height)
+                for to in recipients(tx):
+                    self._by_to[to].append(entry)
+                if "from" in tx:
+                    self._by_from[tx["from"]].append(entry)
+
+    @property
+    def cursor(self):
+        return self._seq
+
+    def query(self, to=None, sender=None, since=0, limit=500):
+        # a page of nothing would always report more, and clients follow `more`
+        limit = max(1, min(limit, MAX_QUERY))
+        with self._lock:
+            index = self._by_to.get(to, []) if to is not None else self._by_from.get(sender, [])
+            # a cursor from before a node restart: start over from the beginning
+            reset = since > self._seq
+            if reset:
+                since = 0
+            # entries are appended in seq order, so bisect straight to the cursor
+            start = bisect.bisect_right(index, since, key=lambda e: e[0])
+            entries = index[start:start + limit]
+            items = [{"seq": seq, "tx_id": tid, "status": status, "height": height, "tx": self._txs[tid]}
+                     for seq, tid, status, height in entries]
+            missing = [(item, self._pruned.get(item["tx_id"])) for item in items if item["tx"] is None]
+        # bodies of pruned txs come from cold storage, outside the lock
+        if self._load is not None:
+            for item, height in missing:
+                item["tx"] = self._load(item["tx_id"], height)
+        cursor = entries[-1][0] if entries else since
+        return {"cursor": cursor, "more": len(entries) == limit, "reset": reset, "items": items}
+
+
+def recipients(tx):
+    to = tx.get("to")
+    if isinstance(to, list):
+        return to
+    return [to] if to is not None else []
@@ -1,21 +1,70 @@
-from flask import Flask, request, jsonify
-from blockchain import Blockchain
+from flask import Flask, Response, abort, g, request, jsonify
+from admission import Gate, RateLimiter, Throttled, TooLarge
+from archive import BlockArchive
+from blockchain import MINING_DIFFICULTY, Blockchain, block_from_dict, tx_id
+from chain_actor import PRIORITY_TX, Busy, ChainActor
+from events import EventLog
+from gossip import PEER_VIEW, RESYNC_TXS, SHUFFLE_SIZE, InFlight, SeenCache, compact_block, fanout, rebuild_block
+from inbox import MAX_QUERY, InboxIndex
+from metrics import Counter, Gauge, Histogram, render as render_metrics
+from peers import PeerTable
+from snapshot import Snapshot, check_chunk, restore
+from profiler import RequestTrace, collapsed, sample_stacks, server_timing, top_frames
+from verifier import KeyRegistry, Verifier, load_public_key, signed_payload
 from wallet import (
     generate_rsa_keypair,
+    generate_signing_keypair,
+    key_id,
+    key_scheme,
     serialize_public_key,
     serialize_private_key,
     sign_message,
-    verify_signature,
+    encrypt_for_group,
     encrypt_with_public,
     decrypt_with_private,
-    deserialize_public_key,
     load_private_key,
 )
-import requests, json, os
+from concurrent.futures import ThreadPoolExecutor
+import requests, hmac, json, math, os, time, threading
+import wire
 
 app = Flask(__name__)
 
 NODE_PORT = int(os.environ.get("PORT", 5000))
+NODE_URL = os.environ.get("NODE_URL", f"http://127.0.0.1:{NODE_PORT}")
+PROBE_INTERVAL = float(os.environ.get("PROBE_INTERVAL", 10))
+SYNC_CHUNK = 50  # blocks per /chain request when fetching missing ancestors
+KEY_FETCHES = int(os.environ.get("KEY_FETCHES", 16))  # unknown sender keys fetched per relayed tx or block
+SYNC_WINDOW = int(os.environ.get("SYNC_WINDOW", 1000))  # most blocks one ancestor fetch pulls
+VERIFY_WORKERS = int(os.environ.get("VERIFY_WORKERS", 4))
+MAX_BATCH = int(os.environ.get("MAX_BATCH", 1000))
+# every node verifies every tx but only its author signs it, and RSA-PSS verifies
+# several times faster than Ed25519 with this cryptography build (see bench.py)
+SIGN_SCHEME = os.environ.get("SIGN_SCHEME", "rsa-pss")
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", 32))
+SSE_LIMIT = int(os.environ.get("SSE_LIMIT", WSGI_THREADS // 4))  # open /events streams; each holds a thread
+SSE_RETRY = 30   # seconds a refused stream is told to wait
+GOSSIP_INTERVAL = float(os.environ.get("GOSSIP_INTERVAL", 5))
+FANOUT = int(os.environ.get("FANOUT", 0))  # 0: derive from the view size
+PRUNE_DEPTH = int(os.environ.get("PRUNE_DEPTH", 0))   # 0: keep every tx body
+ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH", "")     # where pruned bodies go; empty: discard them
+SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", 100))  # blocks between snapshots; 0: off
+SNAPSHOT_VERIFY = int(os.environ.get("SNAPSHOT_VERIFY", 50_000))  # newest snapshot txs whose signatures are checked; 0: all
+BOOTSTRAP_FROM = [p for p in os.environ.get("BOOTSTRAP_FROM", "").split(",") if p]
+MAX_GROUP = int(os.environ.get("MAX_GROUP", 256))   # recipients per group message
+DEBUG_TOKEN = os.environ.get("DEBUG_TOKEN")  # unset: /debug endpoints and tracing are off
+# admission control; rates are txs per second, 0 turns a limit off
+CLIENT_RATE = float(os.environ.get("CLIENT_RATE", 20))
+CLIENT_BURST = float(os.environ.get("CLIENT_BURST", 1000))
+PEER_RATE = float(os.environ.get("PEER_RATE", 500))
+PEER_BURST = float(os.environ.get("PEER_BURST", 2000))
+INGRESS_LIMIT = int(os.environ.get("INGRESS_LIMIT", 16))     # tx requests being worked on at once
+ACTOR_BACKLOG = int(os.environ.get("ACTOR_BACKLOG", 1000))   # queued tx commands before 429s
+RELAY_BACKLOG = int(os.environ.get("RELAY_BACKLOG", 1000))   # queued tx relays before they are dropped
+if CLIENT_RATE:
+    # a batch or group costs a token per item, so no more than a full bucket can ever get in
+    MAX_BATCH = min(MAX_BATCH, int(CLIENT_BURST))
+    MAX_GROUP = min(MAX_GROUP, int(CLIENT_BURST))
 
 # ---- Key management ----
 key_file = f"node_keys_{NODE_PORT}.json"
@@ -28,122 +77,998 @@ if os.path.exists(key_file):
 else:
     priv, pub = generate_rsa_keypair()
     pub_pem_b64 = serialize_public_key(pub)
+    saved = {
+        "private": serialize_private_key(priv),
+        "public": pub_pem_b64
+    }
+    with open(key_file, "w") as f:
+        f.write(json.dumps(saved))
+
+# transactions are signed with a separate key so new nodes can use Ed25519;
+# key files from before this only hold the RSA pair, so add one on first start
+if SIGN_SCHEME == "rsa-pss":
+    sign_priv = priv
+elif "sign_private" in saved:
+    sign_priv = load_private_key(saved["sign_private"])
+else:
+    sign_priv, _ = generate_signing_keypair(SIGN_SCHEME)
+    saved["sign_private"] = serialize_private_key(sign_priv)
     with open(key_file, "w") as f:
-        f.write(json.dumps({
-            "private": serialize_private_key(priv),
-            "public": pub_pem_b64
-        }))
+        f.write(json.dumps(saved))
+sign_pub_b64 = serialize_public_key(sign_priv.public_key())
+sign_kid = key_id(sign_pub_b64)
+
+peers = PeerTable()
+blockchain = Blockchain(prune_depth=PRUNE_DEPTH or None)
+archive = BlockArchive(ARCHIVE_PATH) if ARCHIVE_PATH else None
+keys = KeyRegistry()
+keys.add(sign_pub_b64, pinned=True)
+verifier = Verifier(keys, workers=VERIFY_WORKERS)
+events = EventLog()
+inbox = InboxIndex(load=lambda tid, height: archived_tx(tid, height))
+seen = SeenCache()
+inflight = InFlight()
+profile_lock = threading.Lock()
+client_limits = RateLimiter(CLIENT_RATE, CLIENT_BURST)
+peer_limits = RateLimiter(PEER_RATE, PEER_BURST)
+ingress = Gate(INGRESS_LIMIT)
+relay_backlog = Gate(RELAY_BACKLOG)
+sse_clients = Gate(SSE_LIMIT)
+
+# ---- metrics ----
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Request handling time until the response is returned",
+                         labels=("method", "route", "status"))
+POW_SECONDS = Histogram("pow_seconds", "Proof of work per mined block")
+POW_HASHES = Counter("pow_hashes_total", "Hashes tried by proof of work; divide by pow_seconds_sum for hash rate")
+VALIDATE_SECONDS = Histogram("chain_validation_seconds", "Block and chain validation", labels=("check",))
+PEER_SECONDS = Histogram("peer_request_seconds", "Requests to peers (relay, gossip)", labels=("peer", "path"))
+PEER_FAILURES = Counter("peer_request_failures_total", "Failed requests to peers", labels=("peer", "path"))
+SERVE_SECONDS = Histogram("chain_serialize_seconds", "Building /chain and /headers bodies", labels=("format",))
+SERVE_BYTES = Counter("chain_response_bytes_total", "Bytes of /chain and /headers bodies", labels=("format",))
+THROTTLED = Counter("requests_throttled_total", "Requests refused with 429, or 413 for reason=size", labels=("route", "reason"))
+RELAYS_DROPPED = Counter("tx_relays_dropped_total", "Tx relays skipped because the relay backlog was full")
+
+# time the chain's hot methods on this instance; accept_block and add_branch
+# call validate_block through self, so they pick the wrappers up
+blockchain.proof_of_work = POW_SECONDS.timed(blockchain.proof_of_work)
+blockchain.validate_block = VALIDATE_SECONDS.timed(blockchain.validate_block, "block")
+blockchain.is_valid_chain = VALIDATE_SECONDS.timed(blockchain.is_valid_chain, "chain")
 
-peers = set()
-blockchain = Blockchain()
+# one keep-alive session and a small pool so a slow peer never blocks a request
+http = requests.Session()
+http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=32))
+broadcast_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="broadcast")
+sync_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sync")
+# ancestor fetches get their own small pool: they wait on sync_pool themselves,
+# so running them there could fill it with fetches waiting for each other
+ancestor_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ancestors")
+ancestor_fetches = set()   # senders with a fetch queued or running
+ancestor_lock = threading.Lock()
+snapshot_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot")
+latest_snapshot = None
+syncing = bool(BOOTSTRAP_FROM)   # true until the snapshot bootstrap finishes
 
 # ---- Endpoints ----
 @app.route("/id", methods=["GET"])
 def get_id():
-    return jsonify({"public_key": pub_pem_b64, "port": NODE_PORT})
+    return jsonify({"public_key": pub_pem_b64, "port": NODE_PORT,
+                    "sign_key": sign_pub_b64, "sign_kid": sign_kid, "scheme": key_scheme(sign_priv)})
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Cheap liveness probe used by peers."""
+    return jsonify({"height": actor.snapshot.height, "port": NODE_PORT, "syncing": syncing})
 
 @app.route("/peers", methods=["GET"])
 def get_peers():
-    return jsonify(list(peers))
+    """Peer table with latency, failures, last-seen time and circuit state."""
+    return jsonify(peers.stats())
 
 @app.route("/peers/register", methods=["POST"])
 def register_peer():
     data = request.get_json()
     host = data.get("host")
-    if host:
+    if host and host not in peers:
         peers.add(host)
-    return jsonify({"peers": list(peers)})
+        events.publish("peers", peers.urls())
+    return jsonify({"peers": peers.urls()})
 
-@app.route("/tx/new", methods=["POST"])
-def new_transactions():
-    tx = request.get_json()
+@app.route("/peers/exchange", methods=["POST"])
+def exchange_peers():
+    """Membership gossip: merge the caller's sample of its view and answer with a sample of ours."""
+    data = read_body()
+    if not isinstance(data, dict) or not isinstance(data.get("peers", []), list):
+        return reply({"message": "expected an object with host and a list of peers"}, 400)
+    host = data.get("host")
+    if not isinstance(host, str):
+        host = None
+    offered = ([host] if host else []) + data.get("peers", [])
+    offered = [u for u in offered if isinstance(u, str) and u.startswith("http") and u != NODE_URL]
+    ours = peers.sample(SHUFFLE_SIZE, exclude=[host])
+    before = set(peers.urls())
+    peers.merge(offered, ours, PEER_VIEW)
+    if set(peers.urls()) != before:
+        events.publish("peers", peers.urls())
+    snap = actor.snapshot
+    if host and isinstance(data.get("height"), int) and data["height"] < snap.height:
+        broadcast_pool.submit(send_compact_block, host, snap.tip, compact_block(snap.tip))
+    return reply({"peers": ours, "height": snap.height})
+
+@app.route("/keys/register", methods=["POST"])
+def register_key():
+    """Register a signing key once; transactions can then send sender_kid instead of sender_pub."""
+    data = read_body()
+    admit()
     try:
-        sender_pub_b64 = tx["sender_pub"]
-        sender_pub = deserialize_public_key(sender_pub_b64)
-        signed_payload = (tx["from"] + tx["to"] + tx["message"]).encode()
-        if not verify_signature(sender_pub, signed_payload, tx["signature"]):
-            return jsonify({"message": "invalid signature"}), 400
+        kid = keys.add(data["public_key"])
     except Exception as e:
-        return jsonify({"message": "signature error", "error": str(e)}), 400
+        return jsonify({"message": "bad key", "error": str(e)}), 400
+    return jsonify({"kid": kid}), 201
+
+@app.route("/keys/<kid>", methods=["GET"])
+def get_key(kid):
+    pub_b64 = keys.get(kid)
+    if pub_b64 is None:
+        return jsonify({"message": "unknown key id"}), 404
+    return reply({"kid": kid, "public_key": pub_b64})
+
+@app.route("/tx/new", methods=["POST"])
+def new_transactions():
+    tx = read_body()
+    admit()
+    error = verifier.verify(tx)
+    if error:
+        return reply({"message": error}, 400)
+
+    seen.add(tx_id(tx))
+    added = actor.call(Blockchain.add_transaction, tx, priority=PRIORITY_TX)
+    if not added:
+        return reply({"message": "duplicate", "pending": len(actor.snapshot.pending)}, 200)
+    relay_txs([tx])
+    return reply({"message": "tx added", "pending": len(actor.snapshot.pending)}, 201)
+
+@app.route("/tx/batch", methods=["POST"])
+def new_transaction_batch():
+    """Verify an array of signed txs concurrently, add the valid ones in one step
+    and relay them to peers as a single batch. Returns a result per item."""
+    txs = read_body()
+    if not isinstance(txs, list):
+        return jsonify({"message": "expected a list of transactions"}), 400
+    if len(txs) > MAX_BATCH:
+        return jsonify({"message": f"batch larger than {MAX_BATCH}"}), 413
+    admit(len(txs))
 
-    blockchain.add_transaction(tx)
-    broadcast("/tx/receive", tx)
-    return jsonify({"message": "tx added", "pending": len(blockchain.pending_transactions)}), 201
+    errors = verifier.verify_many(txs)
+    valid = [tx for tx, e in zip(txs, errors) if not e]
+    for tx in valid:
+        seen.add(tx_id(tx))
+    added = iter(actor.call(Blockchain.add_transactions, valid, priority=PRIORITY_TX))
+
+    results, relay = [], []
+    for tx, error in zip(txs, errors):
+        if error:
+            results.append({"status": "rejected", "error": error})
+        elif next(added):
+            results.append({"status": "added", "tx_id": tx_id(tx)})
+            relay.append(tx)
+        else:
+            results.append({"status": "duplicate", "tx_id": tx_id(tx)})
+    if relay:
+        relay_txs(relay)
+    return reply({"added": len(relay), "results": results,
+                  "pending": len(actor.snapshot.pending)}, 201 if relay else 200)
 
 @app.route("/tx/receive", methods=["POST"])
 def receive_tx():
-    tx = request.get_json()
-    blockchain.add_transaction(tx)
-    return jsonify({"message": "tx received"}), 201
+    """Transactions relayed by a peer: one tx or a batch of them. New ones are
+    relayed on to a few random peers; ones seen before stop here."""
+    data = read_body()
+    sender = peer_sender()
+    txs = [tx for tx in (data if isinstance(data, list) else [data]) if tx_id(tx) not in seen]
+    admit(len(txs))
+    txs = [tx for tx in txs if seen.add(tx_id(tx))]
+    try:
+        resolve_keys(txs, sender)
+        errors = verifier.verify_many(txs)
+        valid = [tx for tx, e in zip(txs, errors) if not e]
+        added = actor.call(Blockchain.add_transactions, valid, priority=PRIORITY_TX)
+    except Busy:
+        # shed: forget them so a later announcement fetches them again
+        for tx in txs:
+            seen.discard(tx_id(tx))
+        raise
+    relay = [tx for tx, new in zip(valid, added) if new]
+    if relay:
+        relay_txs(relay, exclude=sender)
+    if len(valid) < len(txs):
+        return reply({"message": next(e for e in errors if e), "accepted": len(valid)}, 400)
+    return reply({"message": "tx received", "accepted": len(valid)}, 201)
 
 @app.route("/mine", methods=["POST"])
 def mine():
-    block = blockchain.mine()
-    if block:
-        broadcast("/block/receive", block)
-        return jsonify(block), 201
-    else:
+    # the actor only builds the candidate and accepts the result; proof of work
+    # runs here so the chain keeps taking txs and blocks meanwhile
+    block = actor.call(Blockchain.new_block)
+    if block is None:
         return jsonify({"message": "no transaction"}), 200
+    blockchain.proof_of_work(block)
+    POW_HASHES.inc(amount=block.nonce + 1)
+    status = actor.call(Blockchain.accept_block, block)
+    if status != "added":
+        # another block landed on the same parent while we were mining
+        return jsonify({"message": f"mined block not added: {status}"}), 409
+    relay_block(block)
+    return jsonify(block.to_dict()), 201
+
+@app.route("/inv", methods=["POST"])
+def inventory():
+    """A peer announces tx ids it has; reply with the ones we want it to send."""
+    data = read_body()
+    txs = data.get("txs", []) if isinstance(data, dict) else None
+    if not isinstance(txs, list) or not all(isinstance(i, str) for i in txs):
+        return reply({"message": "expected an object with a list of tx ids"}, 400)
+    if ingress.full() or actor.backlog >= ACTOR_BACKLOG:
+        # saturated: take nothing now; the peer's next anti-entropy round offers them again
+        return reply({"want": []})
+    ids = [i for i in txs if i not in seen]
+    return reply({"want": inflight.claim(ids)})
+
+@app.route("/block/compact", methods=["POST"])
+def receive_compact_block():
+    """Block header plus short tx ids, rebuilt from our mempool. Replies with the
+    positions of txs we lack; the peer resends with those in "prefill"."""
+    data = read_body()
+    try:
+        if data["hash"] in seen:
+            return reply({"message": "duplicate", "want": []}, 200)
+        prefill = {int(i): tx for i, tx in data.get("prefill", [])}
+        block, missing = rebuild_block(data, actor.snapshot.pending, prefill)
+    except (KeyError, TypeError, ValueError, OverflowError) as e:
+        return reply({"message": "malformed block", "error": str(e)}, 400)
+    if missing:
+        return reply({"message": "missing transactions", "want": missing}, 200)
+    if block is None:
+        return reply({"message": "invalid: hash mismatch", "want": []}, 400)
+    return handle_block(block, peer_sender())
 
 @app.route("/block/receive", methods=["POST"])
 def receive_block():
-    block = request.get_json()
-    blockchain.chain.append(block_from_dict(block))
-    return jsonify({"message": "block added"}), 201
+    try:
+        block = block_from_dict(read_body())
+    except (KeyError, TypeError, ValueError, OverflowError) as e:
+        return reply({"message": "malformed block", "error": str(e)}, 400)
+    if block.hash in seen:
+        return reply({"message": "duplicate"}, 200)
+    return handle_block(block, peer_sender())
+
+def handle_block(block, sender):
+    # blocks skip admission control, but a header check comes first so a bogus
+    # block never costs signature checks; sender is None unless it is a known peer
+    if type(block.index) is not int:
+        return reply({"message": "malformed block", "error": "index must be an integer"}, 400)
+    if block.compute_hash() != block.hash or not block.hash.startswith("0" * MINING_DIFFICULTY):
+        return reply({"message": "invalid: bad proof of work"}, 400)
+    error = invalid_transactions([block], sender)
+    if error:
+        return reply({"message": error}, 400)
+
+    status = actor.call(Blockchain.accept_block, block)
+    if status == "orphan":
+        # parent unknown: pull the missing ancestors from the peer that sent it
+        if sender:
+            schedule_ancestors(sender, block)
+        return reply({"message": status}, 202)
+    if status.startswith("invalid"):
+        return reply({"message": status}, 400)
+    if status == "added":
+        relay_block(block, exclude=sender)
+    return reply({"message": status}, 201 if status == "added" else 200)
 
 @app.route("/chain", methods=["GET"])
 def get_chain():
-    return jsonify([b.to_dict() for b in blockchain.chain])
+    """Blocks from ?from=<height>, at most ?limit=<n>. ?format=ndjson streams one block per line."""
+    return serve_blocks("serialized")
+
+@app.route("/headers", methods=["GET"])
+def get_headers():
+    """Block headers (no transactions) for the same ?from / ?limit range as /chain."""
+    return serve_blocks("header_serialized")
+
+@app.route("/block/<block_hash>", methods=["GET"])
+def get_block(block_hash):
+    """One block of the active chain by hash."""
+    block = find_block(actor.snapshot, block_hash)
+    if block is None:
+        return jsonify({"message": "unknown block"}), 404
+    return serve_block(block)
+
+@app.route("/block/height/<int:height>", methods=["GET"])
+def get_block_at(height):
+    """The active chain's block at a height."""
+    snap = actor.snapshot
+    if height >= len(snap.chain):
+        return jsonify({"message": "no block at that height"}), 404
+    return serve_block(snap.chain[height])
+
+@app.route("/block/<block_hash>/transactions", methods=["GET"])
+def get_block_transactions(block_hash):
+    """Tx bodies of a block, from the archive if the block was pruned."""
+    block = find_block(actor.snapshot, block_hash)
+    if block is None:
+        return jsonify({"message": "unknown block"}), 404
+    txs = block_transactions(block)
+    if txs is None:
+        return jsonify({"message": "pruned and not archived"}), 410
+    return reply(txs)
+
+@app.route("/tx/<tid>", methods=["GET"])
+def get_tx(tid):
+    """Where a tx is: its block, height, position and confirmations, with the body
+    (null if pruned and not archived). Mempool txs come back as "pending"."""
+    snap = actor.snapshot
+    loc = find_tx(snap, tid)
+    if loc is not None:
+        block, pos = loc
+        txs = block_transactions(block)
+        return reply({"tx_id": tid, "status": "confirmed", "block_hash": block.hash, "height": block.index,
+                      "position": pos, "confirmations": snap.height - block.index + 1,
+                      "tx": txs[pos] if txs is not None else None})
+    if tid in blockchain.pending_ids:
+        tx = next((t for t in snap.pending if tx_id(t) == tid), None)
+        if tx is not None:
+            return reply({"tx_id": tid, "status": "pending", "tx": tx})
+    return jsonify({"message": "unknown transaction"}), 404
+
+@app.route("/snapshot", methods=["GET"])
+def get_snapshot():
+    """Manifest of the latest chain snapshot: height, tip, checksums of the blob and its chunks."""
+    if latest_snapshot is None:
+        return jsonify({"message": "no snapshot yet"}), 404
+    return jsonify(latest_snapshot.manifest)
+
+@app.route("/snapshot/<sid>/<int:i>", methods=["GET"])
+def get_snapshot_chunk(sid, i):
+    snap = latest_snapshot
+    if snap is None or snap.id != sid or i >= snap.chunk_count():
+        # replaced by a newer snapshot; the joiner starts over with the new manifest
+        return jsonify({"message": "unknown snapshot chunk"}), 404
+    return Response(snap.chunk(i), mimetype="application/octet-stream",
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.route("/events", methods=["GET"])
+def stream_events():
+    """Server-Sent Events stream of new_tx, new_block, reorg and peers events.
+    Resume with Last-Event-ID (or ?since=<id>); filter with ?types=new_tx,new_block."""
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    seq = int(since) if since and since.isdigit() else events.last_seq
+    kinds = set(request.args["types"].split(",")) if request.args.get("types") else None
+    # a stream keeps its server thread until the client goes away, so streams get
+    # a share of the threads and the rest stay free for everything else
+    if not sse_clients.enter():
+        response = jsonify({"message": "too many event streams; retry later or poll /chain and /pending"})
+        response.headers["Retry-After"] = str(SSE_RETRY)
+        return response, 503
+    response = Response(events.stream(seq, kinds), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(sse_clients.leave)
+    return response
+
+@app.route("/inbox", methods=["GET"])
+def get_inbox():
+    """Txs addressed to ?to=<address> (or sent by ?from=<address>) that are new or changed
+    status since ?since=<cursor>. Pass the returned cursor on the next call."""
+    to, sender = request.args.get("to"), request.args.get("from")
+    if not to and not sender:
+        return jsonify({"message": "to or from required"}), 400
+    since = request.args.get("since", 0, type=int)
+    limit = request.args.get("limit", 500, type=int)
+    if limit < 1:
+        return jsonify({"message": "limit must be at least 1"}), 400
+    limit = min(limit, MAX_QUERY)
+    return jsonify(inbox.query(to=to, sender=sender, since=since, limit=limit))
 
 @app.route("/pending", methods=["GET"])
 def get_pending():
     """Return all pending (unmined) transactions."""
-    return jsonify(blockchain.pending_transactions)
+    return jsonify(list(actor.snapshot.pending))
 
 @app.route("/send", methods=["POST"])
 def send_message():
     data = request.get_json()
+    admit()
     to = data["to_node"]
     to_pub = data["to_pub"]
     message = data["message"]
 
-    recipient_pub = deserialize_public_key(to_pub)
+    recipient_pub = load_public_key(to_pub)
     ciphertext = encrypt_with_public(recipient_pub, message)
+    payload = submit_message(to, ciphertext)
+    return jsonify({"sent": True, "cipher": ciphertext, "tx_id": tx_id(payload)}), 200
 
+@app.route("/send/group", methods=["POST"])
+def send_group_message():
+    """One tx for a whole group: {"recipients": [{"node": url, "pub": key}, ...], "message": text}.
+    The message is encrypted once; each member unwraps the content key from its own slot."""
+    data = request.get_json()
+    members = data.get("recipients")
+    if not isinstance(members, list) or not members:
+        return jsonify({"message": "recipients required"}), 400
+    if len(members) > MAX_GROUP:
+        return jsonify({"message": f"group larger than {MAX_GROUP}"}), 413
+    admit(len(members))   # one key wrap per member
+    try:
+        pubs = [load_public_key(m["pub"]) for m in members]
+        to = [m["node"] for m in members]
+    except Exception as e:
+        return jsonify({"message": "bad recipient", "error": str(e)}), 400
+
+    ciphertext = encrypt_for_group(pubs, data["message"])
+    payload = submit_message(to, ciphertext)
+    return jsonify({"sent": True, "recipients": len(to), "tx_id": tx_id(payload)}), 200
+
+def submit_message(to, ciphertext):
+    # sign, add to the mempool and relay; `to` is a node url or a list of them
     payload = {
-        "from": f"http://127.0.0.1:{NODE_PORT}",
+        "from": NODE_URL,
         "to": to,
         "message": ciphertext,
-        "sender_pub": pub_pem_b64,
+        "sender_kid": sign_kid,
+        "scheme": key_scheme(sign_priv),
     }
+    payload["signature"] = sign_message(sign_priv, signed_payload(payload))
+
+    seen.add(tx_id(payload))
+    actor.call(Blockchain.add_transaction, payload, priority=PRIORITY_TX)
+    relay_txs([payload])
+    return payload
 
-    signed = sign_message(priv, (payload["from"] + payload["to"] + payload["message"]).encode())
-    payload["signature"] = signed
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus text format."""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
-    blockchain.add_transaction(payload)
-    broadcast("/tx/receive", payload)
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """Sample all threads for ?seconds=<n> (default 10) every ?interval=<ms> (default 5).
+    Collapsed stacks for flamegraph.pl/speedscope, or ?format=json for a summary.
+    ?idle=1 keeps threads parked in waits. Needs the DEBUG_TOKEN."""
+    if not debug_authorized():
+        abort(404)
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"message": "a profile is already running"}), 409
+    try:
+        stacks, rounds = sample_stacks(request.args.get("seconds", 10, type=float),
+                                       request.args.get("interval", 5, type=float) / 1000,
+                                       include_idle=request.args.get("idle") == "1")
+    finally:
+        profile_lock.release()
+    if request.args.get("format") == "json":
+        return jsonify({"rounds": rounds, "samples": sum(stacks.values()),
+                        "top": top_frames(stacks), "stacks": dict(stacks.most_common(200))})
+    return Response(collapsed(stacks), mimetype="text/plain")
+
+@app.before_request
+def start_timer():
+    g.started = time.perf_counter()
+    # X-Debug-Trace: 1 (with the token) -> Server-Timing breakdown on the response
+    if request.headers.get("X-Debug-Trace") == "1" and debug_authorized():
+        g.trace = RequestTrace()
+        g.trace.start()
+
+@app.after_request
+def stop_trace(response):
+    trace = g.pop("trace", None)
+    if trace is not None:
+        response.headers["Server-Timing"] = server_timing(trace.stop())
+    return response
+
+@app.after_request
+def observe_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_SECONDS.observe(time.perf_counter() - g.started, request.method, route, response.status_code)
+    return response
+
+@app.teardown_request
+def leave_ingress(exc):
+    if g.pop("ingress", False):
+        ingress.leave()
+
+@app.errorhandler(Throttled)
+def throttled(e):
+    THROTTLED.inc(request.url_rule.rule, e.reason)
+    response = jsonify({"message": f"too busy: {e.reason}", "retry_after": e.retry_after})
+    response.headers["Retry-After"] = str(max(1, math.ceil(e.retry_after)))
+    return response, 429
+
+@app.errorhandler(TooLarge)
+def too_large(e):
+    # no amount of waiting admits it; split it into smaller requests
+    THROTTLED.inc(request.url_rule.rule, "size")
+    return jsonify({"message": f"too large: {e}", "max": e.burst}), 413
 
-    return jsonify({"sent": True, "cipher": ciphertext}), 200
+@app.errorhandler(Busy)
+def actor_busy(e):
+    return throttled(Throttled("backlog"))
+
+@app.after_request
+def allow_browser_clients(response):
+    # the React client (and its EventSource) runs on another origin
+    response.headers.setdefault("Access-Control-Allow-Origin", "*")
+    return response
 
 # ---- helpers ----
-def block_from_dict(bdict):
-    from blockchain import Block
-    b = Block(
-        bdict["index"],
-        bdict["timestamp"],
-        bdict["transactions"],
-        bdict["prev_hash"],
-        bdict["nonce"],
-    )
-    b.hash = bdict["hash"]
-    return b
-
-def broadcast(path, payload):
-    for p in list(peers):
+def wants_binary():
+    return wire.binary_available() and wire.BINARY_TYPE in request.headers.get("Accept", "")
+
+def read_body():
+    # msgpack between nodes, JSON for browsers and older peers; 415 only for an
+    # encoding we cannot read, since peers take it as a cue to fall back to JSON
+    try:
+        return wire.decode(request.get_data(), request.content_type)
+    except wire.UnsupportedType:
+        abort(415)
+    except (ValueError, TypeError):
+        abort(400)
+
+def admit(cost=1):
+    """Take `cost` tokens from the caller's bucket and a slot in the ingress gate,
+    or raise Throttled (TooLarge if `cost` is more than the bucket holds). A peer
+    in our view gets the peer budget, but only when the request comes from that
+    peer's address; anyone else is a client, keyed by address. The slot is given
+    back when the request ends."""
+    node = peer_sender()
+    if node:
+        wait = peer_limits.take(node, cost)
+    else:
+        wait = client_limits.take(request.remote_addr, cost)
+    if wait:
+        raise Throttled("rate", wait)
+    if actor.backlog >= ACTOR_BACKLOG:
+        raise Throttled("backlog")
+    if not ingress.enter():
+        raise Throttled("ingress")
+    g.ingress = True
+
+def peer_sender():
+    # the X-Node-Url of a request that really comes from that peer, else None;
+    # only such a sender is fetched from (ancestors, keys)
+    node = request.headers.get("X-Node-Url")
+    if node and peers.from_address(node, request.remote_addr):
+        return node
+    return None
+
+def debug_authorized():
+    given = request.headers.get("X-Debug-Token") or request.args.get("token") or ""
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(given.encode(), DEBUG_TOKEN.encode())
+
+def reply(obj, status=200):
+    if wants_binary():
+        return Response(wire.encode(obj), status=status, mimetype=wire.BINARY_TYPE)
+    return jsonify(obj), status
+
+def post_peer(peer, path, payload, timeout=1):
+    start = time.time()
+    try:
+        binary = wire.binary_available() and peers.binary(peer)
+        headers = {"X-Node-Url": NODE_URL, "Accept": wire.BINARY_TYPE if binary else wire.JSON_TYPE,
+                   "Content-Type": wire.BINARY_TYPE if binary else wire.JSON_TYPE}
+        r = http.post(f"{peer}{path}", data=wire.encode(payload, binary), timeout=timeout, headers=headers)
+        if r.status_code == 415 and binary:
+            # peer has no msgpack support; remember and resend as JSON
+            peers.mark_json_only(peer)
+            headers["Content-Type"] = headers["Accept"] = wire.JSON_TYPE
+            r = http.post(f"{peer}{path}", data=wire.encode(payload, False), timeout=timeout, headers=headers)
+        if r.status_code == 429:
+            # the peer is shedding load, which is not a failure of the peer
+            PEER_FAILURES.inc(peer, path)
+            return None
+        r.raise_for_status()
+    except Exception as e:
+        peers.record_failure(peer)
+        PEER_FAILURES.inc(peer, path)
+        app.logger.warning("peer %s%s failed: %s", peer, path, e)
+        return None
+    peers.record_success(peer, time.time() - start)
+    PEER_SECONDS.observe(time.time() - start, peer, path)
+    return r
+
+def serve_blocks(attr):
+    start = request.args.get("from", 0, type=int)
+    limit = request.args.get("limit", type=int)
+    # one snapshot for the whole response: blocks and tag always agree
+    snap = actor.snapshot
+    blocks = snap.blocks_range(start, limit)
+
+    if request.args.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("Accept", ""):
+        fmt = "ndjson"
+    elif attr == "serialized" and wants_binary():
+        fmt = "msgpack"
+    else:
+        fmt = "json"
+
+    # the tip hash changes with every new block or reorg, so it keys the cache;
+    # the body depends on Accept too, so the format is part of the tag
+    tag = f"{snap.tip.hash}:{start}:{limit}:{fmt}"
+    headers = {"ETag": f'"{tag}"', "Vary": "Accept"}
+    if request.if_none_match.contains(tag):
+        return Response(status=304, headers=headers)
+
+    if fmt == "ndjson":
+        def stream():
+            for b in blocks:
+                yield getattr(b, attr) + b"\n"
+        return Response(stream(), mimetype="application/x-ndjson", headers=headers)
+
+    if fmt == "msgpack":
+        with SERVE_SECONDS.time("msgpack"):
+            body = wire.pack_array(packed_block(b) for b in blocks)
+        SERVE_BYTES.inc("msgpack", amount=len(body))
+        return Response(body, mimetype=wire.BINARY_TYPE, headers=headers)
+
+    with SERVE_SECONDS.time("json"):
+        body = b"[" + b",".join(getattr(b, attr) for b in blocks) + b"]"
+    SERVE_BYTES.inc("json", amount=len(body))
+    return Response(body, mimetype="application/json", headers=headers)
+
+def find_block(snap, block_hash):
+    # the indexes are written by the actor thread and may run ahead of the
+    # published snapshot; an entry only counts once the snapshot agrees
+    height = blockchain.hash_index.get(block_hash)
+    if height is None or height >= len(snap.chain) or snap.chain[height].hash != block_hash:
+        return None
+    return snap.chain[height]
+
+def find_tx(snap, tid):
+    loc = blockchain.tx_index.get(tid)
+    if loc is None or loc[0] >= len(snap.chain):
+        return None
+    block = snap.chain[loc[0]]
+    tx_ids = block.tx_ids
+    if loc[1] >= len(tx_ids) or tx_ids[loc[1]] != tid:
+        return None
+    return block, loc[1]
+
+def serve_block(block):
+    # the bytes cached on append: one block's worth of work, whatever the chain length
+    if wants_binary():
+        return Response(packed_block(block), mimetype=wire.BINARY_TYPE)
+    return Response(block.serialized, mimetype="application/json")
+
+def packed_block(block):
+    # binary form is cached on first use, like the JSON bytes are on append
+    packed = getattr(block, "packed", None)
+    if packed is None:
+        packed = block.packed = wire.encode(block.to_dict())
+    return packed
+
+def resolve_keys(txs, sender, limit=KEY_FETCHES):
+    # fetch sender keys we have not seen from the peer that relayed the txs, at
+    # most `limit` of them (None: all, for syncs we started ourselves); txs whose
+    # key is still missing fail verification. sender must be a verified peer.
+    # Key ids are hashes of the key, so whatever comes back is checked on insert.
+    missing = verifier.missing_keys(txs)
+    if not missing or not sender:
+        return
+    missing = [kid for kid in missing if kid.isalnum()][:limit]
+    def fetch(kid):
         try:
-            requests.post(f"{p}{path}", json=payload, timeout=1)
-        except Exception:
-            pass
+            r = http.get(f"{sender}/keys/{kid}", timeout=2)
+            r.raise_for_status()
+            keys.add(r.json()["public_key"], kid)
+        except Exception as e:
+            app.logger.warning("key %s from %s: %s", kid, sender, e)
+    list(sync_pool.map(fetch, missing))
+
+def invalid_transactions(blocks, sender=None, key_limit=KEY_FETCHES):
+    txs = []
+    for b in blocks:
+        if b.pruned:
+            continue   # synced without bodies: covered by the merkle root and PoW only
+        if not isinstance(b.transactions, list):
+            return "bad transactions"
+        txs.extend(b.transactions)
+    resolve_keys(txs, sender, key_limit)
+    return next((e for e in verifier.verify_many(txs) if e), None)
+
+def fetch_blocks(peer, start, limit):
+    accept = wire.BINARY_TYPE if wire.binary_available() else wire.JSON_TYPE
+    r = http.get(f"{peer}/chain", params={"from": start, "limit": limit}, timeout=5,
+                 headers={"Accept": accept})
+    r.raise_for_status()
+    return [block_from_dict(b) for b in wire.decode(r.content, r.headers.get("Content-Type"))]
+
+def schedule_ancestors(sender, block):
+    # one fetch per sender at a time; orphans arriving meanwhile are picked up by
+    # the running fetch's orphan_children or by the sender's next announcement
+    with ancestor_lock:
+        if sender in ancestor_fetches:
+            return
+        ancestor_fetches.add(sender)
+    ancestor_pool.submit(run_ancestor_fetch, sender, block)
+
+def run_ancestor_fetch(sender, block):
+    try:
+        fetch_ancestors(sender, block)
+    finally:
+        with ancestor_lock:
+            ancestor_fetches.discard(sender)
+
+def fetch_ancestors(sender, block):
+    # walk back from the orphan until the fetched run links onto a block we know,
+    # pulling each height range from the sender in parallel chunks. The orphan's
+    # height is the sender's claim, so at most SYNC_WINDOW blocks are pulled: a
+    # block further ahead than that gets the window above our tip, and the rest
+    # comes with the sender's next blocks or gossip rounds.
+    end = block.index
+    start = min(actor.snapshot.height + 1, end)
+    if end - start > SYNC_WINDOW:
+        end, block = start + SYNC_WINDOW, None
+    step = 1
+    fetched = []
+    try:
+        while True:
+            ranges = [(h, min(SYNC_CHUNK, end - h)) for h in range(start, end, SYNC_CHUNK)]
+            parts = sync_pool.map(lambda r: fetch_blocks(sender, *r), ranges)
+            fetched = [b for part in parts for b in part] + fetched
+            if not fetched and block is None:
+                return
+            first = fetched[0] if fetched else block
+            if start == 0 or actor.call(lambda bc: first.prev_hash in bc.hash_index):
+                break
+            if len(fetched) >= SYNC_WINDOW:
+                app.logger.warning("ancestors from %s: no common block within %d blocks", sender, SYNC_WINDOW)
+                return
+            end, start = start, max(0, start - min(step, SYNC_WINDOW - len(fetched)))
+            step *= 2
+    except Exception as e:
+        app.logger.warning("ancestor fetch from %s failed: %s", sender, e)
+        return
+    error = invalid_transactions(fetched, sender, key_limit=None)
+    if error:
+        app.logger.warning("ancestors from %s rejected: %s", sender, error)
+        return
+    if block is None:
+        status = actor.call(lambda bc: bc.add_branch(fetched))
+    else:
+        status = actor.call(lambda bc: bc.add_branch(fetched + [block] + bc.orphan_children(block.hash)))
+    app.logger.info("synced %d blocks from %s: %s", len(fetched) + (block is not None), sender, status)
+    if status == "added":
+        relay_block(block or fetched[-1], exclude=sender)
+
+def schedule_snapshot(kind, data):
+    if kind == "block" and SNAPSHOT_INTERVAL and data.index and data.index % SNAPSHOT_INTERVAL == 0:
+        snapshot_pool.submit(make_snapshot)
+
+def make_snapshot():
+    # runs off the actor thread, on the published chain; bursts coalesce
+    global latest_snapshot
+    chain = actor.snapshot.chain
+    height = (len(chain) - 1) // SNAPSHOT_INTERVAL * SNAPSHOT_INTERVAL
+    if height == 0 or (latest_snapshot and latest_snapshot.manifest["height"] >= height):
+        return
+    latest_snapshot = Snapshot(chain[:height + 1])
+    app.logger.info("snapshot %s at height %d, %d bytes", latest_snapshot.id[:12], height, len(latest_snapshot.blob))
+
+def bootstrap(sources):
+    """Join from a snapshot: manifest from the first source, chunks in parallel from
+    every source offering the same snapshot, then only the blocks after it."""
+    global syncing
+    try:
+        r = http.get(f"{sources[0]}/snapshot", timeout=5)
+        r.raise_for_status()
+        manifest = r.json()
+        offering = [p for p in sources if p == sources[0] or snapshot_id(p) == manifest["id"]]
+
+        def fetch(i):
+            error = None
+            for p in offering[i % len(offering):] + offering[:i % len(offering)]:
+                try:
+                    c = http.get(f"{p}/snapshot/{manifest['id']}/{i}", timeout=10)
+                    c.raise_for_status()
+                    check_chunk(manifest, i, c.content)
+                    return c.content
+                except Exception as e:
+                    error = e
+            raise error
+
+        start = time.time()
+        blocks = restore(manifest, list(sync_pool.map(fetch, range(len(manifest["chunks"])))))
+        # manifest, checksums and chunks all come from peers, so the tx bodies get
+        # the same signature checks as synced blocks. A joiner's verified-tx cache is
+        # empty, so checking a long history would cost a full sync's worth of CPU:
+        # only the newest SNAPSHOT_VERIFY txs are checked, and older blocks stand on
+        # the proof of work built over them, as pruned ones already do
+        error = invalid_transactions(newest_blocks(blocks, SNAPSHOT_VERIFY), sources[0], key_limit=None)
+        if error:
+            raise ValueError(f"snapshot rejected: {error}")
+        status = actor.call(Blockchain.load_snapshot, blocks)
+        snapshot_pool.submit(make_snapshot)   # so we can serve one too
+        app.logger.info("snapshot at height %d from %d peer(s): %s in %.2fs",
+                        manifest["height"], len(offering), status, time.time() - start)
+        catch_up(sources[0])
+    except Exception as e:
+        app.logger.warning("snapshot bootstrap failed, falling back to block sync: %s", e)
+    finally:
+        syncing = False
+
+def newest_blocks(blocks, txs):
+    # the shortest run of blocks ending at the tip that holds `txs` tx bodies
+    if not txs:
+        return blocks
+    start, count = len(blocks), 0
+    while start > 0 and count < txs:
+        start -= 1
+        if not blocks[start].pruned:
+            count += len(blocks[start].transactions)
+    return blocks[start:]
+
+def snapshot_id(peer):
+    try:
+        return http.get(f"{peer}/snapshot", timeout=2).json().get("id")
+    except Exception:
+        return None
+
+def catch_up(peer):
+    # blocks mined after the snapshot, pulled in parallel chunks like ancestors are
+    tip = http.get(f"{peer}/health", timeout=2).json()["height"]
+    start = actor.snapshot.height + 1
+    ranges = [(h, min(SYNC_CHUNK, tip + 1 - h)) for h in range(start, tip + 1, SYNC_CHUNK)]
+    blocks = [b for part in sync_pool.map(lambda r: fetch_blocks(peer, *r), ranges) for b in part]
+    if not blocks:
+        return
+    error = invalid_transactions(blocks, peer, key_limit=None)
+    if error:
+        app.logger.warning("blocks after the snapshot rejected: %s", error)
+        return
+    status = actor.call(lambda bc: bc.add_branch(blocks))
+    if status == "orphan":
+        # the peer reorganized past the snapshot meanwhile
+        fetch_ancestors(peer, blocks[-1])
+
+def publish_event(kind, data):
+    # chain/mempool changes -> client event stream; blocks reuse their cached bytes
+    if kind == "tx":
+        events.publish("new_tx", data)
+    elif kind == "block":
+        events.publish("new_block", data.serialized)
+    elif kind == "reorg":
+        events.publish("reorg", {"fork": data[0].index - 1, "dropped": [b.hash for b in data]})
+
+def remember(kind, data):
+    # once a block is in, neither it nor its txs are worth relaying again
+    if kind == "block":
+        seen.add(data.hash)
+        for tid in data.tx_ids:
+            seen.add(tid)
+
+def pin_keys(kind, data):
+    # keys of confirmed txs stay in the registry for as long as the node runs
+    if kind == "block" and not data.pruned:
+        for tx in data.transactions:
+            if isinstance(tx, dict) and "sender_kid" in tx:
+                keys.pin(tx["sender_kid"])
+
+def block_transactions(block):
+    if not block.pruned:
+        return block.transactions
+    return archive.get(block.hash) if archive is not None else None
+
+def archived_tx(tid, height):
+    # inbox items whose bodies were pruned
+    chain = actor.snapshot.chain
+    if height is None or height >= len(chain):
+        return None
+    block = chain[height]
+    txs = block_transactions(block)
+    if txs is None or tid not in block.tx_ids:
+        return None
+    return txs[block.tx_ids.index(tid)]
+
+if archive is not None:
+    blockchain.listeners.append(archive.on_chain_event)
+blockchain.listeners.append(remember)
+blockchain.listeners.append(pin_keys)
+blockchain.listeners.append(schedule_snapshot)
+blockchain.listeners.append(inbox.on_chain_event)
+blockchain.listeners.append(publish_event)
+# from here on only the actor thread touches blockchain state
+actor = ChainActor(blockchain, max_backlog=ACTOR_BACKLOG)
+
+Gauge("chain_height", "Height of the chain tip", lambda: actor.snapshot.height)
+Gauge("mempool_transactions", "Pending transactions", lambda: len(actor.snapshot.pending))
+Gauge("orphan_blocks", "Blocks waiting for their parent", lambda: len(blockchain.orphans))
+Gauge("chain_actor_backlog", "Commands queued for the chain actor", lambda: actor.backlog)
+Gauge("ingress_active", "Tx requests being worked on", lambda: ingress.active)
+Gauge("tx_relay_backlog", "Tx relays queued for peers", lambda: relay_backlog.active)
+Gauge("keys_registered", "Sender keys held by the key registry", lambda: len(keys))
+Gauge("peers_known", "Peers in the view", lambda: len(peers))
+Gauge("peers_live", "Peers whose circuit is not open", lambda: len(peers.live()))
+if archive is not None:
+    Gauge("archive_bytes", "Size of the cold archive of pruned tx bodies", archive.size)
+Gauge("snapshot_height", "Height of the latest snapshot offered to joining nodes",
+      lambda: latest_snapshot.manifest["height"] if latest_snapshot else 0)
+Gauge("events_published", "Events published to SSE clients since start", lambda: events.last_seq)
+Gauge("sse_clients", "Open /events streams", lambda: sse_clients.active)
+
+def relay_targets(exclude=None):
+    # a few random live peers (circuit closed or due for a half-open trial);
+    # they relay on, so every node sends the same amount per message
+    return peers.sample(fanout(len(peers), FANOUT), exclude=[exclude, NODE_URL])
+
+def relay_txs(txs, exclude=None):
+    ids = [tx_id(tx) for tx in txs]
+    for p in relay_targets(exclude):
+        # bounded: a dropped relay is made up by the next anti-entropy round
+        if not relay_backlog.enter():
+            RELAYS_DROPPED.inc()
+            continue
+        broadcast_pool.submit(queued_announce, p, txs, ids)
+
+def queued_announce(peer, txs, ids):
+    try:
+        announce_txs(peer, txs, ids)
+    finally:
+        relay_backlog.leave()
+
+def announce_txs(peer, txs, ids):
+    # ids first; full txs only for the ones the peer asks for
+    want = set(peer_reply(post_peer(peer, "/inv", {"txs": ids})).get("want", []))
+    if want:
+        post_peer(peer, "/tx/receive", [tx for tx, i in zip(txs, ids) if i in want])
+
+def relay_block(block, exclude=None):
+    compact = compact_block(block)
+    for p in relay_targets(exclude):
+        broadcast_pool.submit(send_compact_block, p, block, compact)
+
+def send_compact_block(peer, block, compact):
+    # header + short ids; a second round fills in whatever the peer's mempool lacks
+    want = peer_reply(post_peer(peer, "/block/compact", compact)).get("want")
+    if want:
+        prefill = [[i, block.transactions[i]] for i in want if 0 <= i < len(block.transactions)]
+        post_peer(peer, "/block/compact", dict(compact, prefill=prefill))
+
+def peer_reply(r):
+    if r is None:
+        return {}
+    try:
+        body = wire.decode(r.content, r.headers.get("Content-Type"))
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+def gossip_peers():
+    # periodic partial view swap with one random peer, plus anti-entropy: push
+    # relays can miss a node, so partners also compare tips and mempools
+    while True:
+        time.sleep(GOSSIP_INTERVAL)
+        target = peers.sample(1)
+        if not target:
+            continue
+        target = target[0]
+        sent = peers.sample(SHUFFLE_SIZE - 1, exclude=[target])
+        got = peer_reply(post_peer(target, "/peers/exchange",
+                                   {"host": NODE_URL, "peers": sent, "height": actor.snapshot.height}))
+        if not got:
+            continue
+        peers.merge([u for u in got.get("peers", []) if isinstance(u, str) and u != NODE_URL], sent, PEER_VIEW)
+        snap = actor.snapshot
+        if isinstance(got.get("height"), int) and got["height"] < snap.height:
+            send_compact_block(target, snap.tip, compact_block(snap.tip))
+        pending = list(snap.pending[-RESYNC_TXS:])
+        if pending:
+            announce_txs(target, pending, [tx_id(tx) for tx in pending])
+
+def probe_peers():
+    while True:
+        time.sleep(PROBE_INTERVAL)
+        for p in peers.due_for_probe(PROBE_INTERVAL):
+            start = time.time()
+            try:
+                http.get(f"{p}/health", timeout=1).raise_for_status()
+                peers.record_success(p, time.time() - start)
+            except Exception:
+                peers.record_failure(p)
 
 # ---- Run server ----
 if __name__ == "__main__":
@@ -151,4 +1076,14 @@ if __name__ == "__main__":
     if raw_peers:
         for p in raw_peers.split(","):
             peers.add(p)
-    app.run(host="0.0.0.0", port=NODE_PORT)
+    threading.Thread(target=probe_peers, daemon=True).start()
+    threading.Thread(target=gossip_peers, daemon=True).start()
+    if BOOTSTRAP_FROM:
+        threading.Thread(target=bootstrap, args=(BOOTSTRAP_FROM,), daemon=True).start()
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host="0.0.0.0", port=NODE_PORT, threaded=True)
+    else:
+        # SSE streams each hold one of these threads; SSE_LIMIT keeps most of them free
+        serve(app, host="0.0.0.0", port=NODE_PORT, threads=WSGI_THREADS)
@@ -0,0 +1,180 @@
+import random, socket, time, threading
+from typing import Dict, List, Set
+from urllib.parse import urlsplit
+
+# circuit breaker settings
+FAILURE_THRESHOLD = 3      # consecutive failures before the circuit opens
+BASE_COOLDOWN = 5.0        # seconds the circuit stays open after first trip
+MAX_COOLDOWN = 300.0       # cap for the exponential backoff
+LATENCY_ALPHA = 0.2        # weight of the newest sample in the latency EWMA
+ADDRESS_TTL = 300.0        # seconds a peer's resolved addresses are reused
+
+
+class Peer:
+    def __init__(self, url):
+        self.url = url
+        self.added = time.time()
+        self.last_seen = None
+        self.last_failure = None
+        self.latency = None          # EWMA of request latency in seconds
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0        # circuit is open (peer skipped) until this time
+        self.trips = 0
+        self.binary = True           # cleared once the peer answers 415 to msgpack
+        self.addresses = None        # IPs its url's host resolved to, and when
+        self.resolved = 0.0
+
+    def state(self, now=None):
+        now = now or time.time()
+        if self.consecutive_failures < FAILURE_THRESHOLD:
+            return "closed"
+        if now < self.open_until:
+            return "open"
+        return "half-open"
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "state": self.state(),
+            "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_seen": self.last_seen,
+            "last_failure": self.last_failure,
+            "binary": self.binary,
+        }
+
+
+class PeerTable:
+    """Known peers with latency/failure stats and a per-peer circuit breaker."""
+
+    def __init__(self):
+        self._peers: Dict[str, Peer] = {}
+        self._lock = threading.Lock()
+
+    def add(self, url):
+        url = url.rstrip("/")
+        with self._lock:
+            if url not in self._peers:
+                self._peers[url] = Peer(url)
+            return self._peers[url]
+
+    def remove(self, url):
+        with self._lock:
+            self._peers.pop(url.rstrip("/"), None)
+
+    def __contains__(self, url):
+        return url.rstrip("/") in self._peers
+
+    def __len__(self):
+        return len(self._peers)
+
+    def urls(self) -> List[str]:
+        with self._lock:
+            return list(self._peers)
+
+    def live(self) -> List[str]:
+        # closed circuits plus half-open ones (a single trial request is let through)
+        now = time.time()
+        with self._lock:
+            return [p.url for p in self._peers.values() if p.state(now) != "open"]
+
+    def sample(self, k, exclude=()) -> List[str]:
+        # random live peers, e.g. the relay targets for one message
+        exclude = {u.rstrip("/") for u in exclude if u}
+        candidates = [u for u in self.live() if u not in exclude]
+        return random.sample(candidates, min(k, len(candidates)))
+
+    def merge(self, urls, replaceable=(), capacity=None):
+        """Add peers learned from a membership exchange, keeping at most capacity.
+
+        When the view is full, new peers take the place of ones we just handed
+        to the other side (they now know them), dead ones first.
+        """
+        replaceable = [u.rstrip("/") for u in replaceable]
+        now = time.time()
+        with self._lock:
+            replaceable.sort(key=lambda u: u in self._peers and self._peers[u].state(now) != "open")
+            for url in urls:
+                url = url.rstrip("/")
+                if url in self._peers:
+                    continue
+                if capacity is not None and len(self._peers) >= capacity:
+                    victim = next((u for u in replaceable if u in self._peers), None)
+                    if victim is None:
+                        break
+                    replaceable.remove(victim)
+                    del self._peers[victim]
+                self._peers[url] = Peer(url)
+
+    def record_success(self, url, latency):
+        with self._lock:
+            p = self._peers.get(url)
+            if p is None:
+                return
+            p.last_seen = time.time()
+            p.successes += 1
+            p.consecutive_failures = 0
+            p.open_until = 0.0
+            p.trips = 0
+            p.latency = latency if p.latency is None else (
+                LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * p.latency)
+
+    def record_failure(self, url):
+        with self._lock:
+            p = self._peers.get(url)
+            if p is None:
+                return
+            now = time.time()
+            p.last_failure = now
+            p.failures += 1
+            p.consecutive_failures += 1
+            if p.consecutive_failures >= FAILURE_THRESHOLD:
+                # trip (or re-trip after a failed half-open trial) with backoff
+                p.open_until = now + min(BASE_COOLDOWN * (2 ** p.trips), MAX_COOLDOWN)
+                p.trips += 1
+
+    def from_address(self, url, addr) -> bool:
+        """True if url is a peer whose host resolves to addr, i.e. a request from
+        addr may really be from that peer; a header naming it proves nothing."""
+        p = self._peers.get(url.rstrip("/"))
+        if p is None or not addr:
+            return False
+        now = time.time()
+        if p.addresses is None or now - p.resolved > ADDRESS_TTL:
+            p.addresses, p.resolved = resolve(p.url), now
+        return addr.removeprefix("::ffff:") in p.addresses
+
+    def binary(self, url):
+        p = self._peers.get(url)
+        return p is not None and p.binary
+
+    def mark_json_only(self, url):
+        with self._lock:
+            if url in self._peers:
+                self._peers[url].binary = False
+
+    def due_for_probe(self, idle_after) -> List[str]:
+        # peers we have not heard from recently, or whose circuit is ready for a trial
+        now = time.time()
+        with self._lock:
+            return [p.url for p in self._peers.values()
+                    if p.state(now) == "half-open"
+                    or (p.state(now) == "closed" and (p.last_seen is None or now - p.last_seen > idle_after))]
+
+    def stats(self) -> List[Dict]:
+        # slowest peers first so the ones dragging the network down are on top
+        with self._lock:
+            rows = [p.to_dict() for p in self._peers.values()]
+        return sorted(rows, key=lambda r: (r["state"] == "closed", -(r["latency_ms"] or 0)))
+
+
+def resolve(url) -> Set[str]:
+    try:
+        host = urlsplit(url).hostname
+        return {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except (OSError, UnicodeError, ValueError):
+        return set()
@@ -0,0 +1,139 @@
+import linecache, os, re, sys, threading, time
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005   # seconds between stack samples
+MAX_DURATION = 60
+
+# leaf frames of threads parked waiting for work, left out unless asked for
+IDLE_FILES = {"threading.py", "queue.py", "selectors.py", "wasyncore.py"}
+# ... or blocked in one of these C calls, seen from the calling line
+IDLE_CALLS = re.compile(r"\b(sleep|wait|select|poll|accept)\(")
+
+
+def _frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _idle(frame):
+    if os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+        return True
+    return bool(IDLE_CALLS.search(linecache.getline(frame.f_code.co_filename, frame.f_lineno)))
+
+
+def _thread_group(name):
+    # waitress-3, verify_1, ... -> one root per pool
+    return re.sub(r"[-_]\d+$", "", name)
+
+
+def sample_stacks(seconds, interval=DEFAULT_INTERVAL, include_idle=False):
+    """Sample every thread's Python stack for `seconds`.
+
+    Returns (Counter of collapsed stacks, number of sampling rounds). Stacks are
+    "thread;outer;...;inner", root first, the input format of flamegraph.pl
+    and speedscope. Only the caller's thread pays for sampling; the others run
+    untouched.
+    """
+    me = threading.get_ident()
+    stacks = Counter()
+    rounds = 0
+    deadline = time.monotonic() + min(seconds, MAX_DURATION)
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if not include_idle and _idle(frame):
+                continue
+            parts = []
+            while frame is not None:
+                parts.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            parts.append(_thread_group(names.get(ident, str(ident))))
+            stacks[";".join(reversed(parts))] += 1
+        rounds += 1
+        time.sleep(interval)
+    return stacks, rounds
+
+
+def collapsed(stacks):
+    return "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+
+
+def top_frames(stacks, n=20):
+    # self samples per innermost frame: where the time actually goes
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    return leaves.most_common(n)
+
+
+# ---- per-request trace ----
+_PY_CATEGORIES = (
+    ("/cryptography/", "crypto"),
+    ("hashlib.py", "hashing"),
+    ("/json/", "json"),
+    ("/msgpack/", "json"),
+    ("/requests/", "network"),
+    ("/urllib3/", "network"),
+    ("/http/client.py", "network"),
+    ("socket.py", "network"),
+    ("threading.py", "wait"),
+    ("queue.py", "wait"),
+)
+_C_CATEGORIES = {"_hashlib": "hashing", "_sha2": "hashing", "_json": "json",
+                 "_socket": "network", "socket": "network", "select": "network"}
+
+
+def _c_category(fn):
+    module = getattr(fn, "__module__", None) or type(getattr(fn, "__self__", None)).__module__
+    if module in _C_CATEGORIES:
+        return _C_CATEGORIES[module]
+    if module.startswith("cryptography"):
+        return "crypto"
+    if module.startswith("msgpack"):
+        return "json"
+    return None
+
+
+class RequestTrace:
+    """Time one request thread spends in crypto, hashing, JSON/msgpack, network
+    I/O and waiting, using sys.setprofile on that thread only.
+
+    Every call is intercepted, so it is slow; it is meant for a handful of
+    requests a developer sends on purpose, not for normal traffic. Time goes
+    to the innermost categorized frame; the rest is "other".
+    """
+
+    def __init__(self):
+        self.totals = Counter()
+        self._stack = []
+        self._last = None
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter()
+        self.totals[self._stack[-1] if self._stack else "other"] += now - self._last
+        self._last = now
+        parent = self._stack[-1] if self._stack else "other"
+        if event == "call":
+            path = frame.f_code.co_filename
+            cat = next((c for key, c in _PY_CATEGORIES if key in path), None)
+            self._stack.append(cat or parent)
+        elif event == "c_call":
+            self._stack.append(_c_category(arg) or parent)
+        elif self._stack:
+            # return, c_return, c_exception; the frames we started inside of
+            # return without a matching call, hence the check
+            self._stack.pop()
+
+    def start(self):
+        self._last = time.perf_counter()
+        sys.setprofile(self._event)
+
+    def stop(self):
+        sys.setprofile(None)
+        return {k: v for k, v in self.totals.items() if v > 0}
+
+
+def server_timing(totals):
+    # Server-Timing header, milliseconds; browsers' dev tools show it per request
+    return ", ".join(f"{k};dur={v * 1000:.2f}" for k, v in sorted(totals.items(), key=lambda kv: -kv[1]))
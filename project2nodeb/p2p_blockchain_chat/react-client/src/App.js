@@ -1,12 +1,10 @@
 // App.js
 import React, {useEffect, useState} from "react";
-import io from "socket.io-client";
 import axios from "axios";
 
 const NODE = process.env.REACT_APP_NODE || "http://127.0.0.1:5000";
 
 function App(){
-  const [socket, setSocket] = useState(null);
   const [peers, setPeers] = useState([]);
   const [chain, setChain] = useState([]);
   const [pending, setPending] = useState([]);
@@ -17,19 +15,40 @@ function App(){
 
   useEffect(()=>{
     axios.get(`${NODE}/id`).then(r=> setMyInfo(r.data));
-    const s = io(NODE);
-    setSocket(s);
-    s.on("connect", ()=> console.log("connected"));
-    s.on("peers", data => setPeers(data));
-    s.on("chain", data => setChain(data));
-    s.on("new_tx", tx => {
-      setPending(p => [tx, ...p]);
-    });
-    s.on("new_block", blk => {
-      setChain(prev => [blk, ...prev]);
-      setPending([]);
-    });
-    return ()=> s.disconnect();
+    const load = ()=>{
+      axios.get(`${NODE}/chain`).then(r=> setChain(r.data.slice().reverse()));
+      axios.get(`${NODE}/pending`).then(r=> setPending(r.data.slice().reverse()));
+      axios.get(`${NODE}/peers`).then(r=> setPeers(r.data.map(p=>p.url)));
+    };
+    load();
+    // server-sent events; the browser resumes from Last-Event-ID after a drop
+    let es, retry;
+    const connect = ()=>{
+      es = new EventSource(`${NODE}/events`);
+      es.addEventListener("peers", e => setPeers(JSON.parse(e.data)));
+      es.addEventListener("new_tx", e => {
+        const tx = JSON.parse(e.data);
+        setPending(p => [tx, ...p]);
+      });
+      es.addEventListener("new_block", e => {
+        const blk = JSON.parse(e.data);
+        const mined = new Set((blk.transactions || []).map(t => t.signature));
+        setChain(prev => [blk, ...prev]);
+        setPending(p => p.filter(t => !mined.has(t.signature)));
+      });
+      es.addEventListener("reorg", load);
+      es.addEventListener("reset", load);
+      es.onerror = ()=>{
+        // a refused stream (503: the node is at its stream limit) is not retried
+        // by the browser, so catch up now and try again later
+        if(es.readyState === EventSource.CLOSED){
+          load();
+          retry = setTimeout(connect, 30000);
+        }
+      };
+    };
+    connect();
+    return ()=>{ clearTimeout(retry); es.close(); };
   }, []);
 
   async function send(){
@@ -63,7 +82,7 @@ function App(){
         <div style={{maxHeight:300,overflow:'auto',background:'#f7f7f7',padding:10}}>
           {pending.map((p,i)=> <div key={i} style={{borderBottom:'1px solid #ddd',padding:6}}>
             <div><strong>from:</strong> {p.from}</div>
-            <div><strong>to:</strong> {p.to}</div>
+            <div><strong>to:</strong> {[].concat(p.to).join(', ')}</div>
             <div><strong>message (cipher):</strong> <code style={{wordBreak:'break-all'}}>{p.message}</code></div>
           </div>)}
         </div>
@@ -77,8 +96,9 @@ function App(){
         <div><strong>prev_hash:</strong> {b.prev_hash}</div>
         <div><strong>hash:</strong> {b.hash}</div>
         <div><strong>txs:</strong>
+          {b.pruned && <small> pruned, {b.tx_ids.length} tx ids kept</small>}
           <ul>
-            {b.transactions.map((t,j)=><li key={j}><small>{t.from} → {t.to} | {t.message.slice(0,24)}...</small></li>)}
+            {(b.transactions || []).map((t,j)=><li key={j}><small>{t.from} → {[].concat(t.to).join(', ')} | {t.message.slice(0,24)}...</small></li>)}
           </ul>
         </div>
       </div>)}
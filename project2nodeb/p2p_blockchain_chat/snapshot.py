@@ -0,0 +1,66 @@
+import hashlib, json, zlib
+from typing import List
+
+from blockchain import Block, block_from_dict
+
+CHUNK_SIZE = 256 * 1024   # bytes per downloadable piece
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class Snapshot:
+    """The chain up to some height as one zlib-compressed blob, cut into chunks.
+
+    The manifest lists the hash of every chunk and of the whole blob, and the
+    snapshot id is the hash of the manifest itself, so a joiner can take the
+    manifest from one peer, pull chunks from any peer offering the same id and
+    check every piece as it arrives.
+    """
+
+    def __init__(self, blocks: List[Block], chunk_size=CHUNK_SIZE):
+        # the blocks' cached JSON: consistent even if one is pruned meanwhile
+        self.blob = zlib.compress(b"[" + b",".join(b.serialized for b in blocks) + b"]")
+        self.chunk_size = chunk_size
+        self.manifest = {
+            "height": blocks[-1].index,
+            "tip": blocks[-1].hash,
+            "size": len(self.blob),
+            "sha256": _sha256(self.blob),
+            "chunk_size": chunk_size,
+            "chunks": [_sha256(self.chunk(i)) for i in range(self.chunk_count())],
+        }
+        self.id = manifest_id(self.manifest)
+        self.manifest["id"] = self.id
+
+    def chunk_count(self):
+        return -(-len(self.blob) // self.chunk_size)
+
+    def chunk(self, i) -> bytes:
+        return self.blob[i * self.chunk_size:(i + 1) * self.chunk_size]
+
+
+def manifest_id(manifest) -> str:
+    body = {k: v for k, v in manifest.items() if k != "id"}
+    return _sha256(json.dumps(body, sort_keys=True, separators=(",", ":")).encode())
+
+
+def check_chunk(manifest, i, data: bytes):
+    if _sha256(data) != manifest["chunks"][i]:
+        raise ValueError(f"chunk {i} does not match the manifest")
+
+
+def restore(manifest, chunks: List[bytes]) -> List[Block]:
+    """Verify the pieces against the manifest and return the blocks in it."""
+    if manifest_id(manifest) != manifest.get("id"):
+        raise ValueError("manifest does not match its id")
+    for i, data in enumerate(chunks):
+        check_chunk(manifest, i, data)
+    blob = b"".join(chunks)
+    if _sha256(blob) != manifest["sha256"]:
+        raise ValueError("snapshot checksum mismatch")
+    blocks = [block_from_dict(b) for b in json.loads(zlib.decompress(blob))]
+    if not blocks or blocks[-1].hash != manifest["tip"] or blocks[-1].index != manifest["height"]:
+        raise ValueError("snapshot tip does not match the manifest")
+    return blocks
@@ -0,0 +1,31 @@
+import unittest
+
+from admission import RateLimiter, TokenBucket, TooLarge
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_takes_within_burst(self):
+        bucket = TokenBucket(rate=20, burst=100)
+        self.assertEqual(bucket.take(100), 0.0)
+        self.assertGreater(bucket.take(1), 0.0)
+
+    def test_cost_above_burst_never_fits(self):
+        bucket = TokenBucket(rate=20, burst=100)
+        for _ in range(5):
+            self.assertEqual(bucket.take(1000), float("inf"))
+        self.assertEqual(bucket.take(100), 0.0)   # nothing was taken
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_cost_above_burst_is_refused(self):
+        limits = RateLimiter(20, 100)
+        for _ in range(5):
+            with self.assertRaises(TooLarge):
+                limits.take("client", 1000)
+
+    def test_off_admits_anything(self):
+        self.assertEqual(RateLimiter(0, 100).take("client", 1000), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
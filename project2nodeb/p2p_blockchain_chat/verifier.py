@@ -0,0 +1,148 @@
+import json, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from blockchain import tx_id
+from metrics import Counter, Histogram
+from wallet import SCHEME_RSA, deserialize_public_key, key_id, verify_signature
+
+KEY_CACHE_SIZE = 1024          # parsed sender keys
+KEY_REGISTRY_SIZE = 100_000    # registered sender keys; the least recently used are forgotten
+VERIFIED_CACHE_SIZE = 100_000  # tx ids whose signature already checked out
+
+VERIFY_SECONDS = Histogram("signature_verify_seconds", "Signature checks that missed the cache", labels=("scheme",))
+VERIFY_CACHED = Counter("signature_verify_cached_total", "Signature checks answered from the verified-tx cache")
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def load_public_key(pub_b64: str):
+    # base64 + PEM parsing is a large share of a verification; senders repeat a lot
+    return deserialize_public_key(pub_b64)
+
+
+class KeyRegistry:
+    """Sender public keys by key id, so transactions only need to carry the id.
+
+    Holds at most `size` keys, forgetting the least recently used; a forgotten
+    key is fetched again from the relaying peer or re-registered by its owner.
+    Pinned keys are never forgotten: the node's own, and every key a confirmed
+    tx was signed with, since blocks carrying those txs must keep verifying.
+    Only registrations nothing on the chain uses yet can be pushed out.
+    """
+
+    def __init__(self, size=KEY_REGISTRY_SIZE):
+        self._keys = OrderedDict()   # kid -> key, least recently used first
+        self._pinned: Dict[str, str] = {}
+        self._size = size
+        self._lock = threading.Lock()
+
+    def add(self, pub_b64: str, kid: Optional[str] = None, pinned=False) -> str:
+        # the id is a hash of the key, so a key fetched from any peer can be checked
+        actual = key_id(pub_b64)
+        if kid is not None and kid != actual:
+            raise ValueError("key does not match key id")
+        load_public_key(pub_b64)  # reject garbage before storing it
+        with self._lock:
+            if pinned:
+                self._pinned[actual] = pub_b64
+            elif actual not in self._pinned:
+                self._keys[actual] = pub_b64
+                self._keys.move_to_end(actual)
+                if len(self._keys) > self._size:
+                    self._keys.popitem(last=False)
+        return actual
+
+    def pin(self, kid: str):
+        # a confirmed tx uses this key; a no-op for unknown or already pinned ids
+        with self._lock:
+            pub_b64 = self._keys.pop(kid, None)
+            if pub_b64 is not None:
+                self._pinned[kid] = pub_b64
+
+    def get(self, kid: str) -> Optional[str]:
+        with self._lock:
+            if kid in self._pinned:
+                return self._pinned[kid]
+            pub_b64 = self._keys.get(kid)
+            if pub_b64 is not None:
+                self._keys.move_to_end(kid)
+            return pub_b64
+
+    def __contains__(self, kid):
+        return kid in self._pinned or kid in self._keys
+
+    def __len__(self):
+        return len(self._pinned) + len(self._keys)
+
+
+def signed_payload(tx: Dict) -> bytes:
+    # group messages (a list "to") sign canonical JSON, so the recipient list cannot
+    # be rewritten into another shape with the same bytes; a plain string "to" keeps
+    # the original concatenation so txs signed before groups still verify
+    if isinstance(tx["to"], list):
+        fields = [tx["from"], tx["to"], tx["message"], tx.get("scheme", SCHEME_RSA)]
+        return json.dumps(fields, separators=(",", ":")).encode()
+    return (tx["from"] + tx["to"] + tx["message"]).encode()
+
+
+class Verifier:
+    """Checks transaction signatures, remembering which tx ids already passed."""
+
+    def __init__(self, registry: KeyRegistry, workers=4):
+        self.registry = registry
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="verify")
+
+    def _seen(self, tid):
+        with self._lock:
+            if tid in self._verified:
+                self._verified.move_to_end(tid)
+                return True
+            return False
+
+    def _remember(self, tid):
+        with self._lock:
+            self._verified[tid] = True
+            if len(self._verified) > VERIFIED_CACHE_SIZE:
+                self._verified.popitem(last=False)
+
+    def verify(self, tx: Dict) -> Optional[str]:
+        """Return None if tx is correctly signed, otherwise the reason it is not."""
+        try:
+            tid = tx_id(tx)
+            if self._seen(tid):
+                VERIFY_CACHED.inc()
+                return None
+            pub = load_public_key(self.sender_key(tx))
+            # txs from before the scheme tag existed are RSA-PSS
+            scheme = tx.get("scheme", SCHEME_RSA)
+            with VERIFY_SECONDS.time(scheme):
+                ok = verify_signature(pub, signed_payload(tx), tx["signature"], scheme)
+            if not ok:
+                return "invalid signature"
+        except Exception as e:
+            return f"signature error: {e}"
+        self._remember(tid)
+        return None
+
+    def sender_key(self, tx: Dict) -> str:
+        if "sender_pub" in tx:
+            return tx["sender_pub"]
+        pub_b64 = self.registry.get(tx["sender_kid"])
+        if pub_b64 is None:
+            raise LookupError(f"unknown key id {tx['sender_kid']}")
+        return pub_b64
+
+    def missing_keys(self, txs: List[Dict]):
+        return {tx["sender_kid"] for tx in txs
+                if isinstance(tx, dict) and "sender_pub" not in tx
+                and isinstance(tx.get("sender_kid"), str) and tx["sender_kid"] not in self.registry}
+
+    def verify_many(self, txs: List[Dict]) -> List[Optional[str]]:
+        # a single tx is cheaper inline than a round trip through the pool
+        if len(txs) <= 1:
+            return [self.verify(tx) for tx in txs]
+        return list(self._pool.map(self.verify, txs))
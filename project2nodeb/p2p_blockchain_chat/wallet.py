@@ -1,6 +1,30 @@
 from cryptography.hazmat.primitives import serialization, hashes
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-import base64
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ed25519
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from collections import OrderedDict
+import base64, os, struct, threading, time, zlib
+from metrics import Histogram
+
+HYBRID_MAGIC = b"HY1"
+GROUP_MAGIC = b"HG1"
+FLAG_ZLIB = 0x01
+COMPRESS_MIN = 64            # don't bother compressing tiny messages
+SESSION_MAX_MESSAGES = 10000  # rotate the per-recipient content key after this many messages
+SESSION_TTL = 3600           # ... or after this many seconds
+UNWRAP_CACHE_SIZE = 4096
+SESSION_CACHE_SIZE = 4096    # recipients with a live content key; the least recently used are dropped
+GROUP_CACHE_SIZE = 256       # groups likewise; an entry holds a key slot per member
+
+DECRYPT_SECONDS = Histogram("decrypt_seconds", "Message decryptions", labels=("format",))
+
+SCHEME_RSA = "rsa-pss"      # 2048-bit RSA-PSS, 256-byte signatures (original scheme)
+SCHEME_ED25519 = "ed25519"  # 32-byte keys, 64-byte signatures, much cheaper to verify
+
+_OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+_session_lock = threading.Lock()
+_send_sessions = OrderedDict()    # recipient key fingerprint -> [aes key, wrapped key, uses, created]
+_group_sessions = OrderedDict()   # sorted member fingerprints -> [aes key, key slots, uses, created]
+_unwrapped = OrderedDict()        # (our key fingerprint, wrapped key) -> aes key
 
 
 def generate_rsa_keypair():
@@ -9,19 +33,48 @@ def generate_rsa_keypair():
     return priv, pub
 # generated a 2048 bit RSA key pair returns both private and pubic key
 
+def generate_signing_keypair(scheme=SCHEME_ED25519):
+    if scheme == SCHEME_RSA:
+        return generate_rsa_keypair()
+    if scheme != SCHEME_ED25519:
+        raise ValueError(f"unknown signature scheme {scheme}")
+    priv = ed25519.Ed25519PrivateKey.generate()
+    return priv, priv.public_key()
+# key pair used only for signing transactions (Ed25519 can't encrypt,
+# so the RSA pair stays the node's encryption key)
+
+def key_scheme(key):
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return SCHEME_ED25519
+    return SCHEME_RSA
+# signature scheme tag for a private or public key
+
 def serialize_public_key(pub):
+    if isinstance(pub, ed25519.Ed25519PublicKey):
+        return base64.b64encode(pub.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )).decode()
     return base64.b64encode(pub.public_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PublicFormat.SubjectPublicKeyInfo
     )).decode()
 # turn public key into PEM format -> then base64 encodes ->returns a string useful to store/send over network
+# Ed25519 keys are sent as their raw 32 bytes instead
 
 def deserialize_public_key(b64):
     pem = base64.b64decode(b64.encode())
+    if len(pem) == 32:
+        return ed25519.Ed25519PublicKey.from_public_bytes(pem)
     from cryptography.hazmat.primitives.serialization import load_pem_public_key
     return load_pem_public_key(pem)
 # base64 string → PEM → real public_key object
 
+def key_id(pub_b64: str) -> str:
+    return _sha256(base64.b64decode(pub_b64.encode())).hex()[:32]
+# short hash-based id for a serialized public key; transactions reference
+# a registered key by this id instead of embedding the key itself
+
 def serialize_private_key(priv, password=None):
     if isinstance(password, str):   # auto-convert string passwords
         password = password.encode()
@@ -45,18 +98,25 @@ def load_private_key(b64, password=None):
 # needs password if key was encrypted
 
 def sign_message(priv, message: bytes):
+    if isinstance(priv, ed25519.Ed25519PrivateKey):
+        return base64.b64encode(priv.sign(message)).decode()
     sig = priv.sign(
         message,
         padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
         hashes.SHA256()
     )
     return base64.b64encode(sig).decode()
-# signs a message with the private key using RSA-PSS+SHA256
+# signs a message with the private key using RSA-PSS+SHA256 (or Ed25519 for Ed25519 keys)
 # returns the signature as base64 text
 
-def verify_signature(pub, message: bytes, signature_64: str) -> bool:
+def verify_signature(pub, message: bytes, signature_64: str, scheme=None) -> bool:
+    if scheme is not None and scheme != key_scheme(pub):
+        return False
     sig = base64.b64decode(signature_64.encode())
     try:
+        if isinstance(pub, ed25519.Ed25519PublicKey):
+            pub.verify(sig, message)
+            return True
         pub.verify(sig, message,
                    padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH),
                    hashes.SHA256()
@@ -67,22 +127,146 @@ def verify_signature(pub, message: bytes, signature_64: str) -> bool:
 # take a message + signature + public key
 # verifies if signature is valid 
 # return true if correct else false
+# if a scheme tag is given the key must be of that scheme
+
+def key_fingerprint(key) -> bytes:
+    if hasattr(key, "private_bytes"):
+        key = key.public_key()
+    return _sha256(key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo))
+# sha256 of the DER public key, used to key the session caches
+
+def _sha256(data: bytes) -> bytes:
+    h = hashes.Hash(hashes.SHA256())
+    h.update(data)
+    return h.finalize()
+
+def _session_key(pub):
+    fp = key_fingerprint(pub)
+    now = time.time()
+    with _session_lock:
+        s = _send_sessions.get(fp)
+        if s is None or s[2] >= SESSION_MAX_MESSAGES or now - s[3] > SESSION_TTL:
+            key = AESGCM.generate_key(bit_length=256)
+            s = _send_sessions[fp] = [key, pub.encrypt(key, _OAEP), 0, now]
+            if len(_send_sessions) > SESSION_CACHE_SIZE:
+                _send_sessions.popitem(last=False)   # that recipient just gets a fresh key next time
+        _send_sessions.move_to_end(fp)
+        s[2] += 1
+        return s[0], s[1]
+# one RSA wrap per recipient per session instead of per message
+
+def _compress(plaintext: str):
+    data = plaintext.encode()
+    if len(data) >= COMPRESS_MIN:
+        packed = zlib.compress(data)
+        if len(packed) < len(data):
+            return packed, FLAG_ZLIB
+    return data, 0
+# zlib only when it actually makes the message smaller
 
 def encrypt_with_public(pub, plaintext: str) -> str:
-    ct = pub.encrypt(
-        plaintext.encode(),
-        padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
-    )
-    return base64.b64encode(ct).decode()
-# encrypts a string with a public key using RSA-OAEP+SHA256
-# output is base64 ciphertext
+    data, flags = _compress(plaintext)
+    key, wrapped = _session_key(pub)
+    header = HYBRID_MAGIC + struct.pack(">BH", flags, len(wrapped)) + wrapped
+    nonce = os.urandom(12)
+    ct = AESGCM(key).encrypt(nonce, data, header)
+    return base64.b64encode(header + nonce + ct).decode()
+# hybrid: AES-256-GCM over the (optionally zlib-compressed) message, with the
+# AES key RSA-OAEP wrapped for the recipient; no size limit on the message
+# output is base64 of magic | flags | wrapped key length | wrapped key | nonce | ciphertext
+
+def _group_key(pubs):
+    fps = {key_fingerprint(pub): pub for pub in pubs}
+    gk = tuple(sorted(fps))
+    now = time.time()
+    with _session_lock:
+        s = _group_sessions.get(gk)
+        if s is None or s[2] >= SESSION_MAX_MESSAGES or now - s[3] > SESSION_TTL:
+            key = AESGCM.generate_key(bit_length=256)
+            slots = b"".join(bytes.fromhex(_public_kid(pub)) + struct.pack(">H", len(w)) + w
+                             for pub, w in ((pub, pub.encrypt(key, _OAEP)) for pub in fps.values()))
+            s = _group_sessions[gk] = [key, struct.pack(">H", len(fps)) + slots, 0, now]
+            if len(_group_sessions) > GROUP_CACHE_SIZE:
+                _group_sessions.popitem(last=False)
+        _group_sessions.move_to_end(gk)
+        s[2] += 1
+        return s[0], s[1]
+# like _session_key, for a whole group: the key is wrapped once per member per session
+
+def encrypt_for_group(pubs, plaintext: str) -> str:
+    data, flags = _compress(plaintext)
+    key, slots = _group_key(pubs)
+    header = GROUP_MAGIC + bytes([flags]) + slots
+    nonce = os.urandom(12)
+    ct = AESGCM(key).encrypt(nonce, data, header)
+    return base64.b64encode(header + nonce + ct).decode()
+# one AES-256-GCM ciphertext for every member; the content key is RSA-OAEP wrapped
+# once per member and each member finds its slot by key id
+# output is base64 of magic | flags | member count | (key id, wrapped key length, wrapped key)... | nonce | ciphertext
+
+def _public_kid(key) -> str:
+    if hasattr(key, "private_bytes"):
+        key = key.public_key()
+    return key_id(serialize_public_key(key))
+# key id (as in key_id) of a key object; a recipient looks its own slot up with it
+
+def _unwrap(priv, wrapped: bytes) -> bytes:
+    ck = (key_fingerprint(priv), wrapped)
+    with _session_lock:
+        key = _unwrapped.get(ck)
+        if key is not None:
+            _unwrapped.move_to_end(ck)
+            return key
+    key = priv.decrypt(wrapped, _OAEP)
+    with _session_lock:
+        _unwrapped[ck] = key
+        if len(_unwrapped) > UNWRAP_CACHE_SIZE:
+            _unwrapped.popitem(last=False)
+    return key
+# RSA-unwraps a content key once per conversation, cached after that
 
 def decrypt_with_private(priv, ciphertext_b64: str) -> str:
     ct = base64.b64decode(ciphertext_b64.encode())
-    pt = priv.decrypt(
-        ct,
-        padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
-    )
-    return pt.decode()
-# decrypts cipher text with private key
+    if ct.startswith(GROUP_MAGIC):
+        with DECRYPT_SECONDS.time("group"):
+            return _decrypt_group(priv, ct)
+    if not ct.startswith(HYBRID_MAGIC):
+        # legacy messages: the whole plaintext RSA-OAEP encrypted
+        with DECRYPT_SECONDS.time("rsa"):
+            return priv.decrypt(ct, _OAEP).decode()
+    with DECRYPT_SECONDS.time("hybrid"):
+        return _decrypt_hybrid(priv, ct)
+# decrypts any of the formats with the private key
 # returns original string
+
+def _decrypt_hybrid(priv, ct: bytes) -> str:
+    flags, wlen = struct.unpack_from(">BH", ct, len(HYBRID_MAGIC))
+    body = len(HYBRID_MAGIC) + 3 + wlen
+    header, nonce, sealed = ct[:body], ct[body:body + 12], ct[body + 12:]
+    key = _unwrap(priv, header[len(HYBRID_MAGIC) + 3:])
+    data = AESGCM(key).decrypt(nonce, sealed, header)
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(data)
+    return data.decode()
+# HY1 layout: magic, flags, wrapped key length, wrapped key, nonce, AES-GCM ciphertext
+
+def _decrypt_group(priv, ct: bytes) -> str:
+    flags, count = struct.unpack_from(">BH", ct, len(GROUP_MAGIC))
+    mine = bytes.fromhex(_public_kid(priv))
+    pos = len(GROUP_MAGIC) + 3
+    wrapped = None
+    for _ in range(count):
+        kid, (wlen,) = ct[pos:pos + 16], struct.unpack_from(">H", ct, pos + 16)
+        if kid == mine:
+            wrapped = ct[pos + 18:pos + 18 + wlen]
+        pos += 18 + wlen
+    if wrapped is None:
+        raise ValueError("not a recipient of this message")
+    header, nonce, sealed = ct[:pos], ct[pos:pos + 12], ct[pos + 12:]
+    data = AESGCM(_unwrap(priv, wrapped)).decrypt(nonce, sealed, header)
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(data)
+    return data.decode()
+# HG1: skip over the member slots to ours; the whole header is the GCM associated data
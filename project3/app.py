@@ -6,7 +6,7 @@ import json, os
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
-blockchain = Blockchain()
+blockchain = Blockchain(path=os.path.join(BASE_DIR, "votes.chain"))  # votes survive a restart
 
 class VotingApp:
     def __init__(self, root):
@@ -1,10 +1,55 @@
-import time, hashlib, json
+import time, json, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))  # shared chaincore package
+from chaincore import Adapter, Chain, ChainStore, item_id, merkle_root
+
+class VoteAdapter(Adapter):
+    # how chaincore reads the dict blocks used here
+    def height(self, block):
+        return block['index']
+
+    def hash(self, block):
+        return block['hash']
+
+    def prev_hash(self, block):
+        return block['previous_hash']
+
+    def nonce(self, block):
+        return 0  # no proof of work in the voting app
+
+    def header(self, block):
+        votes_root = merkle_root([item_id(v) for v in block['votes']])
+        return (block['index'], float(block['timestamp']), votes_root, block['previous_hash'])
+
+    def items(self, block):
+        return block['votes']
+
+    def item_id(self, vote):
+        return vote['voter_id']  # one vote per voter, so the index is keyed by voter
+
+    def to_record(self, block):
+        return json.dumps(block, sort_keys=True).encode()
+
+    def from_record(self, data):
+        return json.loads(data)
+
+ADAPTER = VoteAdapter()
 
 class Blockchain:
-    def __init__(self):
-        self.chain = []
+    def __init__(self, path=None):
+        # with a path the chain is kept on disk and checked again on every start
+        self.core = Chain(ADAPTER, store=ChainStore(path) if path else None)
         self.current_votes = []
-        self.create_block(previous_hash="1")  # Genesis block
+        self.pending_voters = set()
+        self.tally = {}
+        for block in self.core:
+            self._count(block)
+        if not self.core.blocks:
+            self.create_block(previous_hash="1")  # Genesis block
+
+    @property
+    def chain(self):
+        return self.core.blocks
 
     def create_block(self, previous_hash):
         block = {
@@ -15,24 +60,24 @@ class Blockchain:
             'hash': ''
         }
         block['hash'] = self.hash(block)
+        reason = self.core.append(block)
+        if reason:
+            raise ValueError(f"block rejected: {reason}")
+        self._count(block)
         self.current_votes = []
-        self.chain.append(block)
+        self.pending_voters = set()
         return block
 
     def add_vote(self, voter_id, candidate):
-        # Prevent double voting
-        for block in self.chain:
-            for vote in block['votes']:
-                if vote['voter_id'] == voter_id:
-                    return False
-        for vote in self.current_votes:
-            if vote['voter_id'] == voter_id:
-                return False
+        # Prevent double voting: the chain index and the pending set, no scans
+        if voter_id in self.core.index.items or voter_id in self.pending_voters:
+            return False
 
         self.current_votes.append({
             'voter_id': voter_id,
             'candidate': candidate
         })
+        self.pending_voters.add(voter_id)
         return True
 
     def mine_block(self):
@@ -41,13 +86,15 @@ class Blockchain:
         return self.create_block(self.chain[-1]['hash'])
 
     def hash(self, block):
-        block_copy = block.copy()
-        block_copy['hash'] = ''
-        return hashlib.sha256(json.dumps(block_copy, sort_keys=True).encode()).hexdigest()
+        return ADAPTER.compute_hash(block)
+
+    def _count(self, block):
+        for vote in block['votes']:
+            self.tally[vote['candidate']] = self.tally.get(vote['candidate'], 0) + 1
 
     def get_tally(self):
-        tally = {}
-        for block in self.chain:
-            for vote in block['votes']:
-                tally[vote['candidate']] = tally.get(vote['candidate'], 0) + 1
-        return tally
+        # kept up to date as blocks are added
+        return dict(self.tally)
+
+    def is_valid(self):
+        return self.core.is_valid()